@@ -0,0 +1,111 @@
+"""
+Latency of /search under concurrent load, to compare two server versions.
+
+Starts `--clients` concurrent clients that each send `--requests` searches to a running server,
+then prints p50 / p99 / max latency and the throughput, and appends them to results/search_benchmark.csv.
+With --same-query every client sends the same query (a burst of identical searches), otherwise
+each request picks one of the --queries at random.
+
+python bench_search.py --label before --clients 50
+python bench_search.py --label after --clients 50 --same-query
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_QUERIES = [
+    "a dog playing in the park",
+    "a plate of food on a table",
+    "people riding bicycles in the street",
+    "a cat sleeping on a couch",
+    "a train at the station",
+    "a man surfing a wave",
+]
+
+
+def send_search(url, query, limit, timeout):
+    body = json.dumps({"query": query, "limit": limit}).encode("utf-8")
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+        status = response.status
+    return time.perf_counter() - start, status
+
+
+def run_benchmark(url, queries, clients=50, requests_per_client=20, limit=10, timeout=60):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients)
+
+    def client(seed):
+        nonlocal errors
+        rng = random.Random(seed)
+        barrier.wait()  # all clients start together
+        for _ in range(requests_per_client):
+            try:
+                latency, status = send_search(url, rng.choice(queries), limit, timeout)
+                with lock:
+                    latencies.append(latency)
+                    errors += status != 200
+            except Exception:
+                with lock:
+                    errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "clients": clients,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        "max_ms": float(latencies.max()) if len(latencies) else None,
+        "requests_per_second": len(latencies) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure /search latency under concurrent clients.")
+    parser.add_argument("--url", default="http://localhost:8000/search")
+    parser.add_argument("--label", default="current", help="Name of the measured version, e.g. before / after.")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20, help="Searches sent by each client.")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--same-query", action="store_true", help="Every request sends the first query.")
+    parser.add_argument("--queries", nargs="*", default=DEFAULT_QUERIES)
+    parser.add_argument("--output-csv", default="results/search_benchmark.csv")
+    args = parser.parse_args()
+
+    queries = args.queries[:1] if args.same_query else args.queries
+    row = {"label": args.label, "same_query": args.same_query}
+    row.update(run_benchmark(args.url, queries, args.clients, args.requests, args.limit))
+    print(f"{args.label}: {row['requests']} requests from {row['clients']} clients, "
+          f"p50 {row['p50_ms']:.1f} ms, p99 {row['p99_ms']:.1f} ms, max {row['max_ms']:.1f} ms, "
+          f"{row['requests_per_second']:.1f} req/s, {row['errors']} errors")
+
+    os.makedirs(os.path.dirname(args.output_csv) or ".", exist_ok=True)
+    new_file = not os.path.isfile(args.output_csv)
+    with open(args.output_csv, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(row))
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+    print(f"Appended the measurement to {args.output_csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,19 @@
 import os
-from hashlib import md5
 import sqlite3
 import time
+from fingerprints import fingerprint_directory
 
 def generate_captions(directory, model, conn, prompt):
     """Generates captions for images and stores them in the database."""
     cursor = conn.cursor()
+    hashes = fingerprint_directory(conn, directory)
 
     for filename in os.listdir(directory):
         if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.heic')):
             full_path = os.path.join(directory, filename)
 
-            # Compute the MD5 hash of the image
-            with open(full_path, 'rb') as f:
-                file_data = f.read()
-                file_hash = md5(file_data).hexdigest()
+            # MD5 hash of the image, only recomputed if the file changed since the last run
+            file_hash = hashes[full_path]
 
             # Check if captions already exist
             cursor.execute("SELECT md5 FROM captions WHERE md5 = ?", (file_hash,))
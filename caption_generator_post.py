@@ -1,11 +1,11 @@
-from PIL import Image
 import os
 import json
-from hashlib import md5
+from fingerprints import fingerprint_directory
 from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
 from db import init_db
+from db_connection import get_writer
 from MAP import calculate_map
-from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
+from hf_captioner import BatchCaptioner
 
 
 def calculate_precision_recall(generated_caption, reference_captions):
@@ -27,18 +27,17 @@ def calculate_precision_recall(generated_caption, reference_captions):
     return precision, recall, f1_score
 
 
-def generate_captions(image_dir, output_path="data/coco_subset/other_model_captions.json", prompt="Generate a short, realistic caption like those in the MS-COCO dataset", reference_captions_path="data/coco_subset/references.json"):
+def generate_captions(image_dir, output_path="data/coco_subset/other_model_captions.json", prompt="Generate a short, realistic caption like those in the MS-COCO dataset", reference_captions_path="data/coco_subset/references.json", batch_size=8, num_threads=None):
     """
     Generate captions using the pre-trained ViT-GPT2 model and save them to a JSON file and database.
     """
     # Load the pre-trained ViT-GPT2 model and tokenizer
-    model = VisionEncoderDecoderModel.from_pretrained("ydshieh/vit-gpt2-coco-en")
-    processor = ViTImageProcessor.from_pretrained("ydshieh/vit-gpt2-coco-en")
-    tokenizer = AutoTokenizer.from_pretrained("ydshieh/vit-gpt2-coco-en")
+    captioner = BatchCaptioner(batch_size=batch_size, num_threads=num_threads)
 
     # Initialize the database
     conn = init_db("labels.db")
-    cursor = conn.cursor()
+    writer = get_writer(conn)
+    hashes = fingerprint_directory(conn, image_dir)
 
     # Load reference captions
     with open(reference_captions_path, "r") as f:
@@ -51,54 +50,49 @@ def generate_captions(image_dir, output_path="data/coco_subset/other_model_capti
     else:
         captions = {}
 
-    for filename in os.listdir(image_dir):
-        if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-            image_path = os.path.join(image_dir, filename)
-
-            # Check if the image is already processed
-            if filename in captions:
-                print(f"Caption already exists for {filename}: {captions[filename]}")
-                continue
-
-            try:
-                # Generate a caption for the image
-                image = Image.open(image_path).convert("RGB")
-                inputs = processor(images=image, return_tensors="pt")
-                output_ids = model.generate(inputs.pixel_values)
-                caption = tokenizer.decode(output_ids[0], skip_special_tokens=True)
-
-                # Calculate MD5 hash for the image file
-                with open(image_path, "rb") as f:
-                    md5_hash = md5(f.read()).hexdigest()
-
-                # Get reference captions for the image
-                references = reference_captions.get(filename, [])
-
-                # Calculate precision, recall, and F1-score
-                precision, recall, f1_score = calculate_precision_recall(caption, references)
-
-                print(f"Image: {filename}")
-                print(f"Generated Caption: {caption}")
-                print(f"Precision: {precision:.4f}, Recall: {recall:.4f}, F1-Score: {f1_score:.4f}")
-
-                # Add the caption to the JSON dictionary
-                captions[filename] = caption
-
-                # Save the results to the database
-                cursor.execute("""
-                    INSERT OR REPLACE INTO captions (md5, gemini_caption, huggingface_caption)
-                    VALUES (?, ?, ?)
-                """, (md5_hash, caption, None))  # Hugging Face caption is None for now
-
-                cursor.execute("""
-                    INSERT OR REPLACE INTO images (md5, image_path, prompt, label)
-                    VALUES (?, ?, ?, ?)
-                """, (md5_hash, image_path, prompt, caption))
-
-                conn.commit()
-            except Exception as e:
-                print(f"Failed to generate caption for {filename}: {e}")
-                captions[filename] = "No caption generated"
+    filenames = [filename for filename in os.listdir(image_dir) if filename.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    for filename in filenames:
+        if filename in captions:
+            print(f"Caption already exists for {filename}: {captions[filename]}")
+
+    # Caption all the new images in batches first
+    pending = [os.path.join(image_dir, filename) for filename in filenames if filename not in captions]
+    generated = captioner.caption_files(pending)
+
+    for image_path in pending:
+        filename = os.path.basename(image_path)
+        try:
+            caption = generated[image_path]
+            if caption is None:
+                raise ValueError("the image could not be captioned")
+
+            # MD5 hash of the image file, only recomputed if it changed since the last run
+            md5_hash = hashes[image_path]
+
+            # Get reference captions for the image
+            references = reference_captions.get(filename, [])
+
+            # Calculate precision, recall, and F1-score
+            precision, recall, f1_score = calculate_precision_recall(caption, references)
+
+            print(f"Image: {filename}")
+            print(f"Generated Caption: {caption}")
+            print(f"Precision: {precision:.4f}, Recall: {recall:.4f}, F1-Score: {f1_score:.4f}")
+
+            # Add the caption to the JSON dictionary
+            captions[filename] = caption
+
+            # Save the results to the database, the writer commits them in batches
+            writer.transaction([
+                # Hugging Face caption is None for now
+                ("INSERT OR REPLACE INTO captions (md5, gemini_caption, huggingface_caption) VALUES (?, ?, ?)", [(md5_hash, caption, None)]),
+                ("INSERT OR REPLACE INTO images (md5, image_path, prompt, label) VALUES (?, ?, ?, ?)", [(md5_hash, image_path, prompt, caption)]),
+            ])
+        except Exception as e:
+            print(f"Failed to generate caption for {filename}: {e}")
+            captions[filename] = "No caption generated"
+
+    writer.flush()
 
     # Save captions to JSON
     with open(output_path, "w") as f:
@@ -0,0 +1,183 @@
+import threading
+import time
+
+import numpy as np
+
+
+class StringColumn:
+    """Append-only column of strings stored as one UTF-8 buffer plus an offsets array."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = np.zeros(1024, dtype=np.int64)
+        self.size = 0
+
+    def append_many(self, values):
+        encoded = [(value or "").encode("utf-8") for value in values]
+        needed = self.size + len(encoded) + 1
+        if needed > len(self.offsets):
+            self.offsets = np.resize(self.offsets, max(needed, 2 * len(self.offsets)))
+        lengths = np.fromiter((len(value) for value in encoded), dtype=np.int64, count=len(encoded))
+        self.offsets[self.size + 1:self.size + 1 + len(encoded)] = self.offsets[self.size] + np.cumsum(lengths)
+        self.data += b"".join(encoded)
+        self.size += len(encoded)
+
+    def take(self, rows):
+        starts = self.offsets[rows]
+        ends = self.offsets[np.asarray(rows) + 1]
+        return [self.data[start:end].decode("utf-8") for start, end in zip(starts.tolist(), ends.tolist())]
+
+
+class Catalog:
+    """
+    In-memory columnar catalog of the images table: md5 -> path, label and prompt.
+    Rows live in array-backed columns (UTF-8 string buffers, dictionary encoded prompts). Lookups go through a sorted md5 array searched with np.searchsorted, new rows land
+    in a small pending index that is merged into the sorted one once it grows.
+
+    The catalog only follows new rows (rowid above the last one loaded): rows written with INSERT OR REPLACE
+    get a new rowid and are picked up, an in-place UPDATE of the images table is not, reload with from_db then.
+    """
+
+    MERGE_THRESHOLD = 4096
+    # Unknown md5s on the search path refresh the catalog at most this often
+    MISSING_REFRESH_INTERVAL = 5.0
+
+    def __init__(self):
+        self.paths = StringColumn()
+        self.labels = StringColumn()
+        self.prompt_codes = np.zeros(1024, dtype=np.int32)
+        self.prompts = []
+        self.prompt_ids = {}
+        self.size = 0
+
+        # Sorted md5s and the row holding the latest version of each one
+        self.sorted_md5s = np.empty(0, dtype="S32")
+        self.sorted_rows = np.empty(0, dtype=np.int64)
+        self.pending = {}
+
+        self.last_rowid = 0
+        self.lock = threading.RLock()
+        self.last_missing_refresh = 0.0
+        self.missing_refresh_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sorted_md5s) + len(self.pending)
+
+    def _prompt_code(self, prompt):
+        code = self.prompt_ids.get(prompt)
+        if code is None:
+            code = len(self.prompts)
+            self.prompts.append(prompt)
+            self.prompt_ids[prompt] = code
+        return code
+
+    def add(self, md5s, paths, labels, prompts):
+        """Adds or replaces rows, a md5 that is already known points to its new row afterwards."""
+        if not md5s:
+            return
+        with self.lock:
+            start = self.size
+            new_md5s = np.array(md5s, dtype="S32")
+            self.paths.append_many(paths)
+            self.labels.append_many(labels)
+            if start + len(md5s) > len(self.prompt_codes):
+                self.prompt_codes = np.resize(self.prompt_codes, max(start + len(md5s), 2 * len(self.prompt_codes)))
+            self.prompt_codes[start:start + len(md5s)] = [self._prompt_code(prompt) for prompt in prompts]
+            self.size += len(md5s)
+
+            positions = np.searchsorted(self.sorted_md5s, new_md5s)
+            in_range = positions < len(self.sorted_md5s)
+            known = np.zeros(len(new_md5s), dtype=bool)
+            known[in_range] = self.sorted_md5s[positions[in_range]] == new_md5s[in_range]
+            rows = np.arange(start, self.size, dtype=np.int64)
+            self.sorted_rows[positions[known]] = rows[known]
+            for md5, row in zip(new_md5s[~known].tolist(), rows[~known].tolist()):
+                self.pending[md5] = row
+
+            if len(self.pending) > self.MERGE_THRESHOLD:
+                self._merge_pending()
+
+    def _merge_pending(self):
+        pending_md5s = np.array(list(self.pending.keys()), dtype="S32")
+        pending_rows = np.fromiter(self.pending.values(), dtype=np.int64, count=len(self.pending))
+        all_md5s = np.concatenate([self.sorted_md5s, pending_md5s])
+        all_rows = np.concatenate([self.sorted_rows, pending_rows])
+        order = np.argsort(all_md5s, kind="stable")
+        self.sorted_md5s = all_md5s[order]
+        self.sorted_rows = all_rows[order]
+        self.pending = {}
+
+    def rows_for(self, md5s):
+        """Vectorized md5 -> row lookup, -1 for unknown md5s."""
+        keys = np.array(md5s, dtype="S32")
+        with self.lock:
+            rows = np.full(len(keys), -1, dtype=np.int64)
+            if len(self.sorted_md5s):
+                positions = np.searchsorted(self.sorted_md5s, keys)
+                positions = np.minimum(positions, len(self.sorted_md5s) - 1)
+                found = self.sorted_md5s[positions] == keys
+                rows[found] = self.sorted_rows[positions[found]]
+            if self.pending:
+                for index in np.flatnonzero(rows < 0).tolist():
+                    rows[index] = self.pending.get(keys[index], -1)
+            return rows
+
+    def lookup(self, md5s):
+        """Resolves a page of md5s in one go, returns one dict (or None if unknown) per md5."""
+        with self.lock:
+            rows = self.rows_for(md5s)
+            found = np.flatnonzero(rows >= 0)
+            hit_rows = rows[found]
+            paths = self.paths.take(hit_rows)
+            labels = self.labels.take(hit_rows)
+            prompts = [self.prompts[code] for code in self.prompt_codes[hit_rows].tolist()]
+
+        records = [None] * len(md5s)
+        for index, path, label, prompt in zip(found.tolist(), paths, labels, prompts):
+            records[index] = {"md5": md5s[index], "image_path": path, "label": label, "prompt": prompt}
+        return records
+
+    def refresh(self, conn, batch_size=50000):
+        """Loads the rows of the images table added since the last refresh (in-place UPDATEs are not seen)."""
+        cursor = conn.cursor()
+        with self.lock:
+            loaded = 0
+            while True:
+                cursor.execute(
+                    "SELECT rowid, md5, image_path, label, prompt FROM images WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (self.last_rowid, batch_size)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                self.last_rowid = rows[-1][0]
+                rows = [row for row in rows if row[1]]
+                self.add([row[1] for row in rows], [row[2] for row in rows], [row[3] for row in rows], [row[4] for row in rows])
+                loaded += len(rows)
+            return loaded
+
+    def refresh_missing(self, conn):
+        """
+        Refresh for md5s the catalog does not know, e.g. images ingested by another process.
+        Runs at most once every MISSING_REFRESH_INTERVAL seconds and in one thread at a time, so an md5
+        that is in the vector DB but not in SQLite does not make every search read the database.
+        Returns the number of rows loaded.
+        """
+        if not self.missing_refresh_lock.acquire(blocking=False):
+            return 0
+        try:
+            now = time.monotonic()
+            if now - self.last_missing_refresh < self.MISSING_REFRESH_INTERVAL:
+                return 0
+            self.last_missing_refresh = now
+            return self.refresh(conn)
+        finally:
+            self.missing_refresh_lock.release()
+
+    @classmethod
+    def from_db(cls, conn):
+        catalog = cls()
+        loaded = catalog.refresh(conn)
+        catalog._merge_pending()
+        print(f"Loaded {loaded} images into the catalog.")
+        return catalog
@@ -0,0 +1,67 @@
+"""
+Startup-time check for the CLI: imports main.py under `python -X importtime`, saves the report
+to results/importtime_main.txt and fails (exit code 1) when a heavy dependency is imported at
+startup or when `python main.py --help` takes longer than the budget.
+
+python check_startup.py [--budget 1.0]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Only the options that need them may import these
+HEAVY_MODULES = ("torch", "torchvision", "transformers", "pymilvus", "google.genai", "google.generativeai")
+REPORT_PATH = "results/importtime_main.txt"
+
+
+def import_times(module="main"):
+    """Returns {module: cumulative import time in seconds} and the raw -X importtime report."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1e6
+    return times, result.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of main.py.")
+    parser.add_argument("--budget", type=float, default=1.0, help="Maximum seconds for `main.py --help` (default: 1.0).")
+    args = parser.parse_args()
+
+    times, report = import_times("main")
+    os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+    with open(REPORT_PATH, "w") as f:
+        f.write(report)
+    print(f"Saved the import time report to {REPORT_PATH}")
+    for name, seconds in sorted(times.items(), key=lambda item: -item[1])[:10]:
+        print(f"{seconds * 1000:8.1f} ms  {name}")
+
+    failures = [f"{name} is imported at startup" for name in HEAVY_MODULES if name in times]
+
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, "main.py", "--help"], capture_output=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed = time.perf_counter() - start_time
+    print(f"python main.py --help: {elapsed:.2f}s (budget {args.budget:.2f}s)")
+    if elapsed > args.budget:
+        failures.append(f"startup took {elapsed:.2f}s, over the {args.budget:.2f}s budget")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("Startup time OK")
+
+
+if __name__ == "__main__":
+    main()
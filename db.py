@@ -1,16 +1,25 @@
 import sqlite3
 import os
-from hashlib import md5
 import time
+import threading
 import numpy as np
 import pickle
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fingerprints import fingerprint_directory
+from lexical_search import ensure_fts_index
+from db_connection import connect, get_writer
+from pipeline_state import CAPTIONED, EMBEDDED, INDEXED, ensure_pipeline_table, mark_hashed, pending, advance, advance_statement, record_failure, rewind, sync_captioned
 
-def init_db(db_path="labels.db"):
-    """Initializes the SQLite database and creates the necessary tables if they don't exist."""
+def init_db(db_path="labels.db", check_same_thread=True):
+    """
+    Initializes the SQLite database and creates the necessary tables if they don't exist.
+    Pass check_same_thread=False for a connection shared by the server's worker threads.
+    The connection uses the shared settings of db_connection.connect (WAL, synchronous=NORMAL).
+    """
     db_path = os.path.abspath(db_path)  # Make path absolute
     print(f"🔍 Initializing DB at: {db_path}")
 
-    conn = sqlite3.connect(db_path)
+    conn = connect(db_path, check_same_thread=check_same_thread)
     cursor = conn.cursor()
 
     # Create the images table
@@ -63,7 +72,20 @@ def init_db(db_path="labels.db"):
         )
     ''')
 
+    # Embeddings stored before the compact storage mode have no dtype tag, they are float32
+    embedding_columns = {row[1] for row in cursor.execute("PRAGMA table_info(embeddings)")}
+    if "embedding_dtype" not in embedding_columns:
+        cursor.execute("ALTER TABLE embeddings ADD COLUMN embedding_dtype TEXT NOT NULL DEFAULT 'float32'")
+    if "embedding_version" not in embedding_columns:
+        cursor.execute("ALTER TABLE embeddings ADD COLUMN embedding_version INTEGER NOT NULL DEFAULT 1")
+
+    # Lookups by path and prompt (label_images, get_all_labels) and by md5 alone
+    cursor.execute("CREATE INDEX IF NOT EXISTS images_path_prompt ON images (image_path, prompt)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS images_md5 ON images (md5)")
+
     conn.commit()
+    ensure_pipeline_table(conn)
+    ensure_fts_index(conn)
     return conn
 
 def migrate_db(db_path="labels.db"):
@@ -99,126 +121,213 @@ def migrate_db(db_path="labels.db"):
     conn.close()
     print("Database migration completed.")
 
-def label_images(directory, model, conn, prompt):
-    """Iterates over image files in the given directory, labels those not already in the database, and stores the results."""
-    cursor = conn.cursor()
+def _caption_work(conn, directory, prompt):
+    """Registers the images of `directory` in the pipeline state and returns the ones still to caption."""
+    hashes = fingerprint_directory(conn, directory)
+    mark_hashed(conn, hashes, prompt)
+    to_label = [(md5, image_path) for md5, _, image_path, _ in pending(conn, CAPTIONED, prompt=prompt) if image_path in hashes]
+    return hashes, to_label
 
-    nb_files = len([name for name in os.listdir(directory)])
-    files_processed = 0
-    for filename in os.listdir(directory):
-        print(f"Handling file {files_processed} out of {nb_files}")
-        files_processed+=1
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.heic')):
-            full_path = os.path.join(directory, filename)
-            # Check if this image is already labeled with the given prompt
-            cursor.execute("SELECT md5 FROM images WHERE image_path = ? AND prompt = ?", (full_path, prompt))
-
-            if cursor.fetchone() is None:
-                # Call the model to label the image
-                description = model.imageQuery(full_path, prompt)
-                if description:
-                    with open(full_path, 'rb') as f:
-                        file_data = f.read()
-                        file_hash = md5(file_data).hexdigest()
-                    #addd imahe with prompt
-                    cursor.execute(
-                    "INSERT INTO images (md5, image_path, prompt, label) VALUES (?, ?, ?, ?)",
-                    (file_hash, full_path, prompt, description)
-                    )
-
-                    conn.commit()
-                    print(f"Labeled {filename}: {description}")
-                else:
-                    print(f"Failed to label {filename}")
-            else:
-                print(f"Already labeled {filename}")
+def _save_label(writer, md5, full_path, prompt, description, write_failures):
+    """
+    Queues a caption and the move of the image to the captioned stage on the database writer,
+    returns False if there is no caption to save. True only means queued: a write that fails
+    later appends `full_path` to `write_failures`, complete once the writer is flushed.
+    """
+    key = (md5, prompt)
+    if not description:
+        record_failure(writer, [key], "the model returned no caption")
+        return False
+
+    def failed(error):
+        print(f"Could not save the label of {full_path}: {error}")
+        write_failures.append(full_path)
+        record_failure(writer, [key], error)
+
+    writer.transaction([
+        ("INSERT INTO images (md5, image_path, prompt, label) VALUES (?, ?, ?, ?)", [(md5, full_path, prompt, description)]),
+        advance_statement([key], CAPTIONED),
+    ], on_error=failed)
+    return True
+
+def label_images(directory, model, conn, prompt, job=None):
+    """
+    Labels the images of the given directory that are not captioned with `prompt` yet, and stores the results.
+    One image at a time, label_images_concurrent with a single worker.
+    """
+    label_images_concurrent(directory, model, conn, prompt, workers=1, job=job)
 
 def label_images_tests(directory, model, conn, prompt):
-    """Iterates over image files in the given directory, labels those not already in the database, and stores the results."""
-    cursor = conn.cursor()
-    total_images = len([f for f in os.listdir(directory) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.heic'))])
-    labeled_count = 0
-    already_labeled_count = 0
+    """Labels the test images not already in the database with both models, one image at a time."""
+    label_images_tests_concurrent(directory, model, conn, prompt, workers=1)
 
-    for index, filename in enumerate(os.listdir(directory)):
-        print(f"Processing {index + 1}/{total_images} images...")
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.heic')):
-            full_path = os.path.join(directory, filename)
+def _print_throughput(nb_images, start_time):
+    elapsed = time.perf_counter() - start_time
+    rate = nb_images / elapsed if elapsed > 0 else 0.0
+    print(f"Processed {nb_images} images in {elapsed:.1f}s ({rate:.2f} images/sec)")
 
-            # Compute the MD5 hash of the image
-            print(full_path)
-            with open(full_path, 'rb') as f:
-                file_data = f.read()
-                file_hash = md5(file_data).hexdigest()
+def label_images_concurrent(directory, model, conn, prompt, workers=4, job=None):
+    """
+    Labels the images of the given directory that are not captioned with `prompt` yet with a pool of
+    `workers` threads, and stores the results. The throttling is done by the model's rate limiter,
+    the SQLite writes are queued from the calling thread.
+    `job` (a jobs.Job) gets the progress and stops the run when cancelled.
+    """
+    hashes, to_label = _caption_work(conn, directory, prompt)
+    already_labeled_count = len(hashes) - len(to_label)
+    print(f"{len(to_label)} images to label, {already_labeled_count} already labeled, using {workers} workers")
+    if job is not None:
+        job.update(processed=0, total=len(to_label))
+
+    def caption(md5, full_path):
+        if job is not None and job.cancelled:
+            # Images still queued when the job is cancelled are not sent to the model
+            return md5, full_path, None
+        description = model.imageQuery(full_path, prompt)
+        return md5, full_path, description
+
+    labeled_count = 0
+    write_failures = []
+    writer = get_writer(conn)
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(caption, md5, full_path) for md5, full_path in to_label]
+        for index, future in enumerate(as_completed(futures)):
+            md5, full_path, description = future.result()
+            filename = os.path.basename(full_path)
+            if job is not None and job.cancelled and description is None:
+                # Skipped, not failed: only the progress moves
+                job.update(processed=index + 1)
+                continue
+            if _save_label(writer, md5, full_path, prompt, description, write_failures):
+                labeled_count += 1
+                print(f"[{index + 1}/{len(to_label)}] Labeled {filename}: {description}")
+            else:
+                print(f"[{index + 1}/{len(to_label)}] Failed to label {filename}")
+                if job is not None:
+                    job.add_error(f"{filename}: no caption")
+            if job is not None:
+                job.update(processed=index + 1)
+
+    writer.flush()
+    # Captions counted when queued whose write failed
+    labeled_count -= len(write_failures)
+    if job is not None:
+        for full_path in write_failures:
+            job.add_error(f"{os.path.basename(full_path)}: could not save the label")
+    print(f"\nSummary: {labeled_count} new images labeled, {already_labeled_count} images already labeled.")
+    _print_throughput(len(to_label), start_time)
 
-            print(file_hash)
+def label_images_tests_concurrent(directory, model, conn, prompt, workers=4):
+    """
+    Labels the test images not already in the `tests` table with Gemini and the local model, with a pool
+    of `workers` threads for the Gemini requests. The local captions are generated in batches up front.
+    The throttling is done by the model's rate limiter, the SQLite writes stay on the calling thread.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT md5 FROM tests")
+    labeled_hashes = {row[0] for row in cursor.fetchall()}
+    # Guards labeled_hashes so two identical files are not captioned twice
+    hashes_lock = threading.Lock()
+
+    hashes = fingerprint_directory(conn, directory)
+    paths = list(hashes)
+    total_images = len(paths)
+    print(f"{total_images} images found, using {workers} workers")
+
+    # The local model captions the new images in batches up front, the workers only wait on Gemini
+    hf_captions = {}
+    if hasattr(model, "huggingfaceQueryBatch"):
+        new_paths = list({hashes[path]: path for path in reversed(paths) if hashes[path] not in labeled_hashes}.values())
+        hf_captions = model.huggingfaceQueryBatch(new_paths)
+
+    def caption(full_path):
+        file_hash = hashes[full_path]
+        with hashes_lock:
+            if file_hash in labeled_hashes:
+                return full_path, file_hash, None, None, True
+            labeled_hashes.add(file_hash)
+        description_gemini = model.imageQuery(full_path, prompt)
+        if full_path in hf_captions:
+            description_hf = hf_captions[full_path]
+        else:
+            description_hf = model.huggingfaceQuery(full_path)
+        return full_path, file_hash, description_gemini, description_hf, False
 
-            # Check if the image is already labeled in the `tests` table
-            cursor.execute("SELECT md5 FROM tests WHERE md5 = ?", (file_hash,))
-            if cursor.fetchone() is not None:
+    labeled_count = 0
+    already_labeled_count = 0
+    writer = get_writer(conn)
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(caption, full_path) for full_path in paths]
+        for index, future in enumerate(as_completed(futures)):
+            full_path, file_hash, description_gemini, description_hf, skipped = future.result()
+            filename = os.path.basename(full_path)
+            if skipped:
                 already_labeled_count += 1
                 print(f"[{index + 1}/{total_images}] Already labeled {filename}")
                 continue
 
-            # Generate captions for the image
-            description_gemini = model.imageQuery(full_path, prompt)
-            description_hf = model.huggingfaceQuery(full_path)  # Removed 'prompt' argument
-            time.sleep(4)  # 4s delay to stay within ~15 requests/min
-
             if description_gemini or description_hf:
-                # Insert into the `tests` table
-                cursor.execute("""
-                    INSERT INTO tests (md5, image_path, prompt)
-                    VALUES (?, ?, ?)
-                """, (file_hash, full_path, prompt))
-
-                # Insert into the `captions` table
-                cursor.execute("""
-                    INSERT INTO captions (md5, gemini_caption, huggingface_caption)
-                    VALUES (?, ?, ?)
-                """, (file_hash, description_gemini, description_hf))
-
-                conn.commit()
+                writer.transaction([
+                    ("INSERT INTO tests (md5, image_path, prompt) VALUES (?, ?, ?)", [(file_hash, full_path, prompt)]),
+                    ("INSERT INTO captions (md5, gemini_caption, huggingface_caption) VALUES (?, ?, ?)",
+                     [(file_hash, description_gemini, description_hf)]),
+                ])
                 labeled_count += 1
                 print(f"[{index + 1}/{total_images}] Labeled GG{filename}: {description_gemini}")
                 print(f"[{index + 1}/{total_images}] Labeled HF{filename}: {description_hf}")
             else:
                 print(f"[{index + 1}/{total_images}] Failed to label {filename}")
 
+    writer.flush()
     print(f"\nSummary: {labeled_count} new images labeled, {already_labeled_count} images already labeled.")
+    _print_throughput(total_images - already_labeled_count, start_time)
 
-def save_embedding(conn, md5, gemini_embedding, huggingface_embedding):
-    """Saves the embeddings for a given image (identified by md5) to the database."""
-    cursor = conn.cursor()
+# Storage dtypes of the embedding BLOBs, the tag is saved next to each row
+EMBEDDING_DTYPES = {"float32": np.float32, "float16": np.float16}
+EMBEDDING_VERSION = 1
 
+def decode_embedding(blob, dtype="float32"):
+    """Turns an embedding BLOB back into a float32 NumPy array, whatever dtype it was stored with."""
+    if not blob:
+        return None
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPES[dtype]).astype(np.float32, copy=False)
+
+def save_embedding(conn, md5, gemini_embedding, huggingface_embedding, dtype="float32"):
+    """
+    Saves the embeddings for a given image (identified by md5) to the database.
+    dtype="float16" halves the size of the stored BLOBs.
+    The row is queued on the database writer, which commits it with the next batch.
+    """
     try:
         # Convert the embeddings to bytes for storage
-        gemini_embedding_bytes = gemini_embedding.tobytes() if isinstance(gemini_embedding, np.ndarray) else None
-        huggingface_embedding_bytes = huggingface_embedding.tobytes() if isinstance(huggingface_embedding, np.ndarray) else None
+        storage_dtype = EMBEDDING_DTYPES[dtype]
+        gemini_embedding_bytes = gemini_embedding.astype(storage_dtype).tobytes() if isinstance(gemini_embedding, np.ndarray) else None
+        huggingface_embedding_bytes = huggingface_embedding.astype(storage_dtype).tobytes() if isinstance(huggingface_embedding, np.ndarray) else None
 
         if gemini_embedding_bytes is None or huggingface_embedding_bytes is None:
             raise ValueError("One or both embeddings are invalid and cannot be saved.")
 
-        cursor.execute("""
-            INSERT OR REPLACE INTO embeddings (md5, gemini_embedding, huggingface_embedding)
-            VALUES (?, ?, ?)
-        """, (md5, gemini_embedding_bytes, huggingface_embedding_bytes))
-        conn.commit()
+        get_writer(conn).execute("""
+            INSERT OR REPLACE INTO embeddings (md5, gemini_embedding, huggingface_embedding, embedding_dtype, embedding_version)
+            VALUES (?, ?, ?, ?, ?)
+        """, (md5, gemini_embedding_bytes, huggingface_embedding_bytes, dtype, EMBEDDING_VERSION),
+            on_error=lambda e: print(f"Error saving embedding for {md5}: {e}"))
     except Exception as e:
         print(f"Error saving embedding for {md5}: {e}")
-        conn.rollback()
 
 def get_embedding(conn, md5):
     """Retrieves the embeddings for a given image (identified by md5) from the database."""
     cursor = conn.cursor()
     cursor.execute("""
-        SELECT gemini_embedding, huggingface_embedding FROM embeddings WHERE md5 = ?
+        SELECT gemini_embedding, huggingface_embedding, embedding_dtype FROM embeddings WHERE md5 = ?
     """, (md5,))
     result = cursor.fetchone()
     if result:
         # Convert the bytes back to NumPy arrays
-        gemini_embedding = np.frombuffer(result[0], dtype=np.float32) if result[0] else None
-        huggingface_embedding = np.frombuffer(result[1], dtype=np.float32) if result[1] else None
+        gemini_embedding = decode_embedding(result[0], result[2])
+        huggingface_embedding = decode_embedding(result[1], result[2])
         return gemini_embedding, huggingface_embedding
     return None, None
 
@@ -245,27 +354,32 @@ def clean_embeddings_test(conn):
 
     try:
         # Retrieve all embeddings
-        cursor.execute("SELECT md5, gemini_embedding, huggingface_embedding FROM embeddings")
+        cursor.execute("SELECT md5, gemini_embedding, huggingface_embedding, embedding_dtype FROM embeddings")
         rows = cursor.fetchall()
 
         invalid_md5s = []
 
         for row in rows:
-            md5, gemini_blob, huggingface_blob = row
+            md5, gemini_blob, huggingface_blob, dtype = row
+            if dtype not in EMBEDDING_DTYPES:
+                print(f"Unknown embedding dtype {dtype} for MD5: {md5}")
+                invalid_md5s.append(md5)
+                continue
+            itemsize = np.dtype(EMBEDDING_DTYPES[dtype]).itemsize
 
             # Validate BLOB sizes
-            if gemini_blob and len(gemini_blob) % 4 != 0:
+            if gemini_blob and len(gemini_blob) % itemsize != 0:
                 print(f"Invalid Gemini embedding size for MD5: {md5}")
                 invalid_md5s.append(md5)
                 continue
-            if huggingface_blob and len(huggingface_blob) % 4 != 0:
+            if huggingface_blob and len(huggingface_blob) % itemsize != 0:
                 print(f"Invalid Hugging Face embedding size for MD5: {md5}")
                 invalid_md5s.append(md5)
                 continue
 
             # Convert BLOBs back to NumPy arrays
-            gemini_embedding = np.frombuffer(gemini_blob, dtype=np.float32) if gemini_blob else None
-            huggingface_embedding = np.frombuffer(huggingface_blob, dtype=np.float32) if huggingface_blob else None
+            gemini_embedding = decode_embedding(gemini_blob, dtype)
+            huggingface_embedding = decode_embedding(huggingface_blob, dtype)
 
             # Check if either embedding is invalid (None or empty)
             if gemini_embedding is None or huggingface_embedding is None or len(gemini_embedding) == 0 or len(huggingface_embedding) == 0:
@@ -292,15 +406,15 @@ def retrieve_embeddings(conn):
     Retrieves the embeddings and deserializes them back into NumPy arrays.
     """
     cursor = conn.cursor()
-    query = "SELECT * FROM embeddings"
+    query = "SELECT md5, gemini_embedding, huggingface_embedding, embedding_dtype FROM embeddings"
     cursor.execute(query)
     infos = cursor.fetchall()
 
     embeddings = []
     for res in infos:
         md5 = res[0]
-        gemini_embedding = np.frombuffer(res[1], dtype=np.float32) if res[1] else None
-        huggingface_embedding = np.frombuffer(res[2], dtype=np.float32) if res[2] else None
+        gemini_embedding = decode_embedding(res[1], res[3])
+        huggingface_embedding = decode_embedding(res[2], res[3])
 
         if gemini_embedding is None or huggingface_embedding is None:
             print(f"Invalid embeddings found for MD5 {md5}. Skipping...")
@@ -321,35 +435,152 @@ def drop_database():
     print("SQLite database deleted.")
 
 
-def retrieve_images(conn, hashes):
-    """Retrieves the images in the SQL DB and checks if they already exist in Milvus, returns the non-existent ones for embedding."""
+def embed_images(conn, embedder, vector_db, chunk_size=1000, job=None):
+    """
+    Embeds the labels of the captioned images and inserts them into the vector DB, `chunk_size` at a time.
+    The work comes from the pipeline state, a run that stopped halfway only redoes what is left.
+    `job` (a jobs.Job) gets the progress and stops the run between two chunks when cancelled.
+    Returns the number of images indexed.
+    """
+    # State updates go through the single writer, flushed before the state is read again
+    writer = get_writer(conn)
+    # Captions written to `images` outside of label_images get their state row
+    sync_captioned(conn)
     cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM pipeline_state WHERE stage = ? LIMIT 1", (INDEXED,))
+    if cursor.fetchone() is None:
+        # First run with the state table, what was indexed before it existed is only known to the vector DB
+        indexed = set(vector_db.get_all_md5_hashes())
+        advance(writer, [(row[0], row[1]) for row in pending(conn, EMBEDDED) if row[0] in indexed], INDEXED)
+    elif vector_db.count() == 0:
+        # Indexed into another collection (e.g. INDEX_DIM changed), the embeddings come back from the cache
+        print("The vector DB is empty, indexing every captioned image again")
+        rewind(writer, INDEXED, CAPTIONED)
+    writer.flush()
+
+    to_embed = pending(conn, EMBEDDED)
+    interrupted = pending(conn, INDEXED)
+    # One vector per md5: an image captioned with several prompts is indexed once, with its first caption,
+    # and all its (md5, prompt) keys follow it. Milvus would keep a duplicate entity for every insert.
+    indexed_md5s = {row[0] for row in _select_with_md5_filter(
+        conn, {row[0] for row in to_embed + interrupted},
+        f"SELECT DISTINCT s.md5 FROM temp.md5_filter f JOIN pipeline_state s ON s.md5 = f.md5 WHERE s.stage = {INDEXED}"
+    )}
+    advance(writer, [(row[0], row[1]) for row in to_embed + interrupted if row[0] in indexed_md5s], INDEXED)
+    # Embedded but not indexed: the insert was interrupted, remove any partial copy before inserting again
+    for md5 in {row[0] for row in interrupted} - indexed_md5s:
+        vector_db.delete_record(md5)
+    keys_by_md5 = {}
+    first = {}
+    for row in to_embed + interrupted:
+        if row[3] and row[0] not in indexed_md5s:
+            keys_by_md5.setdefault(row[0], []).append((row[0], row[1]))
+            first.setdefault(row[0], row)
+    rows = list(first.values())
+    print(f"{len(to_embed)} images to embed, {len(interrupted)} embedded images to index, "
+          f"{len(rows)} distinct images after skipping the md5s already indexed")
+    if job is not None:
+        job.update(processed=0, total=len(rows))
+    if not rows:
+        writer.flush()
+        return 0
+
+    indexed_count = 0
+    for start in range(0, len(rows), chunk_size):
+        if job is not None and job.cancelled:
+            print(f"Embedding cancelled after {start} out of {len(rows)} captions")
+            break
+        chunk = rows[start:start + chunk_size]
+
+        # Embeddings of the interrupted rows come back from the embedding cache
+        embeddings = embedder.batch_embeddings([row[3] for row in chunk])
+        valid = ~np.isnan(embeddings).any(axis=1)
+        kept = [row for row, is_valid in zip(chunk, valid) if is_valid]
+        kept_keys = [key for row in kept for key in keys_by_md5[row[0]]]
+        failed = [key for row, is_valid in zip(chunk, valid) if not is_valid for key in keys_by_md5[row[0]]]
+        record_failure(writer, failed, "embedding request failed")
+        advance(writer, kept_keys, EMBEDDED)
+        print(f"Embedded {len(kept)} out of {len(chunk)} captions")
+        if job is not None:
+            for row, is_valid in zip(chunk, valid):
+                if not is_valid:
+                    job.add_error(f"{row[0]}: embedding request failed")
+
+        try:
+            vector_db.insert_many(
+                [row[0] for row in kept],  # md5
+                [row[2] for row in kept],  # file_path
+                [row[3] for row in kept],  # description
+                embeddings[valid]
+            )
+        except Exception as e:
+            record_failure(writer, kept_keys, e)
+            writer.flush()
+            raise
+        advance(writer, kept_keys, INDEXED)
+        indexed_count += len(kept)
+        if job is not None:
+            job.update(processed=start + len(chunk))
+    writer.flush()
+    if indexed_count:
+        # Only reports an index the collection outgrew, rebuilding it would stop the live searches
+        vector_db.create_index()
+    return indexed_count
+
+def _load_md5_filter(conn, hashes, batch_size=10000):
+    """
+    Loads the md5s into the indexed temp table md5_filter, in batches, so they can be joined against
+    instead of being bound as one SQL variable each (SQLite caps the number of variables).
+    """
+    cursor = conn.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS md5_filter (md5 TEXT PRIMARY KEY) WITHOUT ROWID")
+    cursor.execute("DELETE FROM temp.md5_filter")
+    hashes = iter(hashes)
+    while True:
+        batch = [(md5,) for _, md5 in zip(range(batch_size), hashes)]
+        if not batch:
+            break
+        cursor.executemany("INSERT OR IGNORE INTO temp.md5_filter (md5) VALUES (?)", batch)
+    return cursor
+
+def _select_with_md5_filter(conn, hashes, query, batch_size=10000):
+    cursor = _load_md5_filter(conn, hashes, batch_size)
+    try:
+        cursor.execute(query)
+        infos = []
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            infos.extend(rows)
+        return infos
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.md5_filter")
+        # The temp table inserts opened a transaction, ending it releases the read snapshot of the WAL
+        conn.commit()
 
-    placeholders = ','.join('?' for _ in hashes)
-    print(placeholders)
-    hashes = list(hashes)
-    print(hashes)
-    query = f"SELECT * FROM images WHERE md5 NOT IN ({placeholders})"
-    cursor.execute(query, hashes)
-
-    infos = cursor.fetchall()
+def retrieve_images(conn, hashes):
+    """Retrieves the images in the SQL DB and checks if they already exist in Milvus, returns the non-existent ones for embedding."""
+    # Anti-join against the indexed temp table, one primary key lookup per image. Rows without an md5
+    # are left out like the NOT IN query did, NOT EXISTS alone would return them
+    infos = _select_with_md5_filter(
+        conn, hashes,
+        "SELECT images.* FROM images WHERE images.md5 IS NOT NULL "
+        "AND NOT EXISTS (SELECT 1 FROM temp.md5_filter f WHERE f.md5 = images.md5)"
+    )
     if not infos:
         raise Exception("No images to label")
     else:
+        print(f"{len(infos)} images are not in the vector DB")
         return infos
 
 def retrive_existing_images(conn, hashes):
     """Retrieves the images in the SQL DB"""
-    cursor = conn.cursor()
-
-    placeholders = ','.join('?' for _ in hashes)
-    print(placeholders)
-    hashes = list(hashes)
-    print(hashes)
-    query = f"SELECT * FROM images WHERE md5 IN ({placeholders})"
-    cursor.execute(query, hashes)
-
-    infos = cursor.fetchall()
+    # Each md5 of the filter is looked up through the md5 index of images
+    infos = _select_with_md5_filter(
+        conn, hashes,
+        "SELECT images.* FROM temp.md5_filter f JOIN images ON images.md5 = f.md5"
+    )
     if not infos:
         raise Exception("No images to label")
     else:
@@ -391,7 +622,9 @@ def get_all_labels(conn, prompt):
 
 
 def get_description_by_md5(conn, md5):
+    """Returns the label of the image with the given md5, or None if it is unknown."""
     cursor = conn.cursor()
     cursor.execute("SELECT label FROM images WHERE md5 = ?", (md5, ))
 
-    return cursor.fetchone()
+    row = cursor.fetchone()
+    return row[0] if row else None
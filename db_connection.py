@@ -0,0 +1,222 @@
+"""
+Shared SQLite connection settings and the single writer thread.
+
+Every connection is opened through `connect` (WAL journal, synchronous=NORMAL, bigger page cache)
+or `connect_readonly`. Writes go through the `SQLiteWriter` of the database: one thread that
+groups the queued rows into transactions by count or time and applies them with executemany.
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+# Page cache per connection, in KiB (negative cache_size values are KiB for SQLite)
+CACHE_SIZE_KB = 64 * 1024
+BUSY_TIMEOUT_SECONDS = 30
+
+
+def _configure(conn):
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def connect(db_path="labels.db", check_same_thread=True):
+    """Read/write connection in WAL mode, readers are never blocked by the writer."""
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread, timeout=BUSY_TIMEOUT_SECONDS)
+    conn.execute("PRAGMA journal_mode = WAL")
+    # With WAL a commit only fsyncs at checkpoints, a power loss can drop the last transactions but not corrupt the file
+    conn.execute("PRAGMA synchronous = NORMAL")
+    # INSERT OR REPLACE only runs the delete triggers (full-text index sync) with recursive triggers on
+    conn.execute("PRAGMA recursive_triggers = ON")
+    return _configure(conn)
+
+
+def connect_readonly(db_path="labels.db", check_same_thread=False):
+    """Read-only connection for the query paths, it can not take the write lock."""
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread, timeout=BUSY_TIMEOUT_SECONDS)
+    return _configure(conn)
+
+
+def database_path(conn):
+    """File path of the main database of a connection."""
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return path
+    return ""
+
+
+_STOP = object()
+
+
+class SQLiteWriter:
+    """
+    Single writer thread of a database. A write is queued as a unit of (sql, rows) statements;
+    the thread commits up to `max_rows` rows or what arrived within `max_delay` seconds in one
+    transaction, running consecutive statements with the same SQL as one executemany.
+    When the batch fails, its units are replayed one by one so a bad row only fails its own unit
+    (`on_error(exception)` is called for it, on the writer thread).
+
+    The execute / executemany / commit methods mirror sqlite3.Connection, commit does not wait:
+    use flush() to wait until everything queued so far is written.
+    """
+
+    def __init__(self, db_path, max_rows=500, max_delay=0.5):
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        self.written = 0
+        self.failed = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=f"sqlite-writer-{os.path.basename(db_path)}", daemon=True)
+        self.thread.start()
+
+    def transaction(self, statements, on_error=None):
+        """Queues statements [(sql, rows), ...] that are applied together or not at all."""
+        if self.closed:
+            raise RuntimeError(f"The writer of {self.db_path} is closed")
+        self.queue.put(([(sql, list(rows)) for sql, rows in statements], on_error))
+
+    def executemany(self, sql, rows, on_error=None):
+        rows = list(rows)
+        if rows:
+            self.transaction([(sql, rows)], on_error)
+
+    def execute(self, sql, params=(), on_error=None):
+        self.transaction([(sql, [params])], on_error)
+
+    def commit(self):
+        # Transactions are committed by the writer thread
+        pass
+
+    def flush(self, timeout=None):
+        """Waits until everything queued before this call is committed."""
+        if self.closed:
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def _run(self):
+        conn = connect(self.db_path, check_same_thread=True)
+        # Transactions are opened and committed explicitly below
+        conn.isolation_level = None
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            batch, barriers, nb_rows = [], [], 0
+            deadline = time.monotonic() + self.max_delay
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    barriers.append(item)
+                else:
+                    batch.append(item)
+                    nb_rows += sum(len(rows) for _, rows in item[0])
+                if stop or barriers or nb_rows >= self.max_rows:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write(conn, batch)
+                except sqlite3.Error as e:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    self.failed += len(batch)
+                    print(f"SQLite writer could not write {len(batch)} queued writes: {e}")
+            for barrier in barriers:
+                barrier.set()
+        conn.close()
+
+    def _write(self, conn, batch):
+        # Consecutive statements with the same SQL become one executemany
+        merged = []
+        for statements, _ in batch:
+            for sql, rows in statements:
+                if merged and merged[-1][0] == sql:
+                    merged[-1][1].extend(rows)
+                else:
+                    merged.append((sql, list(rows)))
+        try:
+            conn.execute("BEGIN")
+            for sql, rows in merged:
+                conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+            self.written += len(batch)
+            return
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"SQLite batch of {len(batch)} writes failed ({e}), retrying them one by one")
+
+        conn.execute("BEGIN")
+        failures = []
+        for statements, on_error in batch:
+            conn.execute("SAVEPOINT unit")
+            try:
+                for sql, rows in statements:
+                    conn.executemany(sql, rows)
+                conn.execute("RELEASE unit")
+                self.written += 1
+            except sqlite3.Error as e:
+                conn.execute("ROLLBACK TO unit")
+                conn.execute("RELEASE unit")
+                self.failed += 1
+                failures.append((on_error, e))
+        conn.execute("COMMIT")
+        for on_error, e in failures:
+            if on_error is None:
+                print(f"SQLite write failed: {e}")
+                continue
+            try:
+                on_error(e)
+            except Exception as callback_error:
+                print(f"SQLite write error handler failed: {callback_error}")
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(conn_or_path):
+    """The writer thread of a database (given as a path or a connection to it), started on first use."""
+    db_path = conn_or_path if isinstance(conn_or_path, str) else database_path(conn_or_path)
+    if not db_path:
+        raise ValueError("The single writer needs a database file, not an in-memory database")
+    db_path = os.path.abspath(db_path)
+    with _writers_lock:
+        writer = _writers.get(db_path)
+        if writer is None or writer.closed:
+            writer = SQLiteWriter(db_path)
+            _writers[db_path] = writer
+        return writer
+
+
+@atexit.register
+def close_writers():
+    """Flushes and stops every writer thread, called on shutdown."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
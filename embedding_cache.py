@@ -0,0 +1,136 @@
+import threading
+import unicodedata
+from collections import OrderedDict
+from hashlib import sha256
+
+import numpy as np
+
+from db_connection import connect
+
+
+def normalize_text(text):
+    """Normalizes unicode and whitespace so trivially different captions share a cache entry."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_key(model, task_type, dim, text):
+    """Content address of an embedding: hash of everything that changes the returned vector."""
+    payload = "\x1f".join([model, task_type or "", str(dim or ""), normalize_text(text)])
+    return sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two tier embedding cache shared by every embedding call site.
+    The disk tier is an SQLite table keyed by make_key(), the memory tier is an LRU
+    bounded by the total size of the vectors it holds.
+    """
+
+    def __init__(self, db_path="embedding_cache.db", max_memory_bytes=256 * 1024 * 1024):
+        self.conn = connect(db_path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, vector):
+        """Adds a vector to the memory tier, evicting the least recently used ones if needed."""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        if vector.nbytes > self.max_memory_bytes:
+            return
+        self.memory[key] = vector
+        self.memory_bytes += vector.nbytes
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def get_many(self, keys):
+        """Returns a list with the cached vector for each key, or None when it is not cached."""
+        results = [None] * len(keys)
+        with self.lock:
+            to_fetch = {}
+            for index, key in enumerate(keys):
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    self.memory_hits += 1
+                    results[index] = vector
+                else:
+                    to_fetch.setdefault(key, []).append(index)
+
+            fetch_keys = list(to_fetch)
+            # Stay well below SQLite's limit on the number of bound variables
+            for start in range(0, len(fetch_keys), 500):
+                chunk = fetch_keys[start:start + 500]
+                placeholders = ','.join('?' for _ in chunk)
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    for index in to_fetch.pop(key):
+                        results[index] = vector
+                        self.disk_hits += 1
+
+            self.misses += sum(len(indexes) for indexes in to_fetch.values())
+        return results
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def put_many(self, keys, vectors):
+        """Stores vectors in both tiers."""
+        rows = []
+        with self.lock:
+            for key, vector in zip(keys, vectors):
+                vector = np.ascontiguousarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, vector) VALUES (?, ?)", rows
+            )
+            self.conn.commit()
+
+    def put(self, key, vector):
+        self.put_many([key], [vector])
+
+    def stats(self):
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Returns the process wide cache, so every Embedder and embed_text share the same entries."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
@@ -0,0 +1,140 @@
+"""
+Exports the SQLite embeddings table into contiguous matrices that can be memory-mapped:
+
+data/embedding_matrices/
+├── gemini.npy (capacity x dim float32)
+├── huggingface.npy (capacity x dim float32)
+├── md5s.npy (capacity md5s)
+└── manifest.json (number of valid rows and last exported rowid)
+
+Each sync only copies the rows added to the table since the previous one.
+"""
+import json
+import os
+
+import numpy as np
+
+from db import EMBEDDING_DTYPES
+
+MATRIX_DIR = "data/embedding_matrices"
+
+
+def _open_matrix(path, capacity, dim, dtype):
+    if os.path.isfile(path):
+        return np.load(path, mmap_mode="r+")
+    shape = (capacity, dim) if dim else (capacity,)
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+
+def _grow(path, matrix, used, needed):
+    """Reallocates a memory-mapped .npy file so it holds at least `needed` rows."""
+    if needed <= matrix.shape[0]:
+        return matrix
+    shape = (max(needed, 2 * matrix.shape[0]),) + matrix.shape[1:]
+    tmp_path = path + ".tmp.npy"
+    grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=matrix.dtype, shape=shape)
+    grown[:used] = matrix[:used]
+    grown.flush()
+    del grown, matrix
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode="r+")
+
+
+def _read_manifest(out_dir):
+    path = os.path.join(out_dir, "manifest.json")
+    if not os.path.isfile(path):
+        return {"count": 0, "last_rowid": 0, "dim": None}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def export_embeddings(conn, out_dir=MATRIX_DIR, batch_size=5000):
+    """
+    Appends the embeddings added since the last export to the gemini / huggingface matrices.
+    Rows with a missing or malformed embedding are skipped, a re-embedded md5 overwrites its row.
+    Returns the number of rows written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = _read_manifest(out_dir)
+    count, dim = manifest["count"], manifest["dim"]
+    paths = {name: os.path.join(out_dir, f"{name}.npy") for name in ("gemini", "huggingface", "md5s")}
+
+    md5s = gemini = huggingface = None
+    rows_by_md5 = {}
+    if dim:
+        md5s = np.load(paths["md5s"], mmap_mode="r+")
+        gemini = np.load(paths["gemini"], mmap_mode="r+")
+        huggingface = np.load(paths["huggingface"], mmap_mode="r+")
+        rows_by_md5 = {md5: row for row, md5 in enumerate(md5s[:count].tolist())}
+
+    cursor = conn.cursor()
+    written = 0
+    while True:
+        cursor.execute(
+            "SELECT rowid, md5, gemini_embedding, huggingface_embedding, embedding_dtype FROM embeddings WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (manifest["last_rowid"], batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        manifest["last_rowid"] = rows[-1][0]
+
+        for _, md5, gemini_blob, huggingface_blob, dtype in rows:
+            storage_dtype = EMBEDDING_DTYPES.get(dtype)
+            itemsize = np.dtype(storage_dtype).itemsize if storage_dtype else 0
+            if not itemsize or not gemini_blob or not huggingface_blob or len(gemini_blob) != len(huggingface_blob) or len(gemini_blob) % itemsize:
+                print(f"Invalid embeddings found for MD5 {md5}. Skipping...")
+                continue
+            if dim is None:
+                dim = len(gemini_blob) // itemsize
+                md5s = _open_matrix(paths["md5s"], 1024, None, "S32")
+                gemini = _open_matrix(paths["gemini"], 1024, dim, np.float32)
+                huggingface = _open_matrix(paths["huggingface"], 1024, dim, np.float32)
+            if len(gemini_blob) != dim * itemsize:
+                print(f"Unexpected embedding size for MD5 {md5}. Skipping...")
+                continue
+
+            key = md5.encode("ascii")
+            row = rows_by_md5.get(key)
+            if row is None:
+                row = count
+                count += 1
+                rows_by_md5[key] = row
+                md5s = _grow(paths["md5s"], md5s, row, count)
+                gemini = _grow(paths["gemini"], gemini, row, count)
+                huggingface = _grow(paths["huggingface"], huggingface, row, count)
+            md5s[row] = key
+            gemini[row] = np.frombuffer(gemini_blob, dtype=storage_dtype)
+            huggingface[row] = np.frombuffer(huggingface_blob, dtype=storage_dtype)
+            written += 1
+
+    if md5s is not None:
+        for matrix in (md5s, gemini, huggingface):
+            matrix.flush()
+    manifest["count"], manifest["dim"] = count, dim
+    _write_manifest(out_dir, manifest)
+    print(f"Exported {written} embeddings, {count} rows in {out_dir}.")
+    return written
+
+
+def load_embedding_matrices(out_dir=MATRIX_DIR):
+    """
+    Memory-maps the exported matrices without copying them.
+    Returns (md5s, gemini, huggingface) sliced to the rows actually filled.
+    """
+    manifest = _read_manifest(out_dir)
+    count = manifest["count"]
+    if not count:
+        raise Exception(f"No exported embeddings found in {out_dir}.")
+    md5s = np.load(os.path.join(out_dir, "md5s.npy"), mmap_mode="r")[:count]
+    gemini = np.load(os.path.join(out_dir, "gemini.npy"), mmap_mode="r")[:count]
+    huggingface = np.load(os.path.join(out_dir, "huggingface.npy"), mmap_mode="r")[:count]
+    print(f"Memory-mapped {count} embeddings from {out_dir}.")
+    return md5s, gemini, huggingface
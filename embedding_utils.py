@@ -5,35 +5,37 @@ from google import genai
 from dotenv import dotenv_values
 import numpy as np
 
+from embedding_cache import get_default_cache, make_key
+
 # Initialize the GenAI client
 config = dotenv_values(".env")
 client = genai.Client(api_key=config.get("API_KEY"))
 
-def embed_text(text, conn):
-    """Generates or retrieves an embedding for a given text."""
-    cursor = conn.cursor()
+EMBEDDING_MODEL = "gemini-embedding-exp-03-07"
+
+def embed_text(text, conn=None):
+    """
+    Generates or retrieves an embedding for a given text.
+    Goes through the same embedding cache as embeddings.Embedder, `conn` is no longer used.
+    """
+    cache = get_default_cache()
+    key = make_key(EMBEDDING_MODEL, None, None, text)
 
     # Check if the embedding already exists
-    cursor.execute("SELECT gemini_embedding FROM embeddings WHERE md5 = ?", (text,))
-    result = cursor.fetchone()
-    if result:
+    cached = cache.get(key)
+    if cached is not None:
         print(f"Using cached embedding for text: {text[:50]}...")
-        return np.frombuffer(result[0], dtype=np.float32)
+        return cached
 
     # Generate a new embedding using Google GenAI
     response = client.models.embed_content(
-        model="gemini-embedding-exp-03-07",
+        model=EMBEDDING_MODEL,
         contents=text
     )
-    embedding = np.array(response.embeddings[0], dtype=np.float32)
-    embedding_bytes = embedding.tobytes()
+    embedding = np.array(response.embeddings[0].values, dtype=np.float32)
 
-    # Save the embedding to the database
-    cursor.execute("""
-        INSERT INTO embeddings (md5, gemini_embedding)
-        VALUES (?, ?)
-    """, (text, embedding_bytes))
-    conn.commit()
+    # Save the embedding to the cache
+    cache.put(key, embedding)
 
     return embedding
 
@@ -42,4 +44,4 @@ def cosine_similarity(embedding1, embedding2):
     """Computes cosine similarity between two embeddings."""
     if embedding1 is None or embedding2 is None:
         return 0.0
-    return float(np.dot(embedding1, embedding2) / (np.linalg.norm(embedding1) * np.linalg.norm(embedding2)))
\ No newline at end of file
+    return float(np.dot(embedding1, embedding2) / (np.linalg.norm(embedding1) * np.linalg.norm(embedding2)))
@@ -1,23 +1,78 @@
 from google import genai
 from dotenv import dotenv_values
 import numpy as np
+import asyncio
 import time
 
+from embedding_cache import get_default_cache, make_key
+from vector_db import embedding_dims
+
+EMBEDDING_DIM = 3072
+# embed_content accepts at most 100 texts per request
+MAX_BATCH_SIZE = 100
+
+class QuotaExceeded(Exception):
+    """The embedding API refused a request because the quota is used up (HTTP 429)."""
+
+
+def is_quota_error(error):
+    """True for the 429 / RESOURCE_EXHAUSTED errors of the genai and google.api_core clients."""
+    return (
+        getattr(error, "code", None) == 429
+        or getattr(error, "status", None) == "RESOURCE_EXHAUSTED"
+        or type(error).__name__ == "ResourceExhausted"
+    )
+
+
 class Embedder:
 
-    def __init__(self):
+    def __init__(self, rate_limiter=None, cache=None, output_dimensionality=None):
+        """
+        `output_dimensionality` defaults to EMBEDDING_DIM in .env, the dimension of the vector store
+        (vector_db.get_vector_db). Keep it at the full size with INDEX_DIM, the re-ranking needs full vectors.
+        """
         config = dotenv_values(".env")
         self.client = genai.Client(api_key=config.get("API_KEY"))
+        self.model = "gemini-embedding-exp-03-07"
+        self.task_type = None
+        output_dimensionality = output_dimensionality or embedding_dims(EMBEDDING_DIM)[0]
+        # None requests the model's full size, which also keeps the cache keys of earlier runs
+        self.output_dimensionality = output_dimensionality if output_dimensionality < EMBEDDING_DIM else None
+        # Shared RateLimiter, when None we fall back to a fixed delay between requests
+        self.rate_limiter = rate_limiter
+        self.cache = cache if cache is not None else get_default_cache()
 
-    def get_embedding(self, content):
+    def cache_key(self, content):
+        return make_key(self.model, self.task_type, self.output_dimensionality, content)
+
+    def embed_config(self):
+        # Gemini embeddings are Matryoshka-style, the API can return a shorter prefix directly
+        if self.output_dimensionality:
+            return {"output_dimensionality": self.output_dimensionality}
+        return None
+
+    def get_embedding(self, content, delay=0):
+        """
+        Returns the embedding of `content`, from the cache when possible.
+        `delay` seconds are waited before calling the API, cache hits are not delayed.
+        """
+        key = self.cache_key(content)
+        cached = self.cache.get(key)
+        if cached is not None:
+            print(f"Using cached embedding for content: {content}")  # Debug print
+            return cached
+
+        if delay:
+            time.sleep(delay)
         try:
             print(f"Generating embedding for content: {content}")  # Debug print
             result = self.client.models.embed_content(
-                model="gemini-embedding-exp-03-07",
-                contents=content
+                model=self.model,
+                contents=content,
+                config=self.embed_config()
             )
             print(f"Raw API response type: {type(result.embeddings)}")  # Debug print
-            
+
             # Extract the actual embedding data
             if hasattr(result.embeddings[0], 'values'):  # Check if 'values' attribute exists
                 embedding = np.array(result.embeddings[0].values, dtype=np.float32)
@@ -25,49 +80,102 @@ class Embedder:
                 raise ValueError(f"Unexpected embedding format: {type(result.embeddings[0])}")
 
             print(f"Generated embedding shape: {embedding.shape}")  # Debug print
+            self.cache.put(key, embedding)
+            return embedding
+        except Exception as e:
+            print(f"Error generating embedding: {e}")
+            return None
+
+    async def aget_embedding(self, content):
+        """
+        Async version of get_embedding for the server, uses the client's asyncio API.
+        Returns None when the request failed, raises QuotaExceeded when it was refused for quota.
+        """
+        key = self.cache_key(content)
+        # The cache may read its SQLite file, keep that off the event loop
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached
+        try:
+            result = await self.client.aio.models.embed_content(
+                model=self.model,
+                contents=content,
+                config=self.embed_config()
+            )
+            embedding = np.array(result.embeddings[0].values, dtype=np.float32)
+            await asyncio.to_thread(self.cache.put, key, embedding)
             return embedding
         except Exception as e:
             print(f"Error generating embedding: {e}")
+            if is_quota_error(e):
+                raise QuotaExceeded(str(e)) from e
             return None
 
-    def batch_embeddings(self, contents):
-        results = []
+    def batch_embeddings(self, contents, batch_size=MAX_BATCH_SIZE):
+        """
+        Embeds many texts with one embed_content request per `batch_size` texts not already cached.
+        Returns a float32 matrix of shape (len(contents), dim), the rows of a batch that
+        failed are filled with NaN so callers can filter them with np.isnan.
+        """
+        batch_size = min(batch_size, MAX_BATCH_SIZE)
         nb_embed = len(contents)
-        nb_done = 0
-        for content in contents:
-            print(f"Finished the {nb_done} out of {nb_embed}")
-            print(f"Embeded caption: {content}")
-            nb_done += 1
-            time.sleep(4)
+        keys = [self.cache_key(content) for content in contents]
+        cached = self.cache.get_many(keys)
+        missing = [index for index, vector in enumerate(cached) if vector is None]
+        print(f"{nb_embed - len(missing)} out of {nb_embed} captions found in the embedding cache")
+
+        dim = next((len(vector) for vector in cached if vector is not None), None)
+        computed = {}
+
+        for start in range(0, len(missing), batch_size):
+            batch_indexes = missing[start:start + batch_size]
+            batch = [contents[index] for index in batch_indexes]
+            print(f"Embedding captions {start} to {start + len(batch)} out of {len(missing)}")
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            elif start > 0:
+                time.sleep(4)  # 4s delay between requests to stay within the quota
             try:
-                embedding = self.get_embedding(content)
-                if embedding is None or not isinstance(embedding, list):
-                    print(f"Invalid embedding for content: {content}. Skipping...")
-                    results.append(None)
-                else:
-                    results.append(embedding)
+                result = self.client.models.embed_content(
+                    model=self.model,
+                    contents=batch,
+                    config=self.embed_config()
+                )
+                vectors = np.array([embedding.values for embedding in result.embeddings], dtype=np.float32)
+                if vectors.shape[0] != len(batch):
+                    raise ValueError(f"Expected {len(batch)} embeddings, got {vectors.shape[0]}")
             except Exception as e:
-                print(f"Error {e} has occurred for content {content}")
-                results.append(None)
+                print(f"Error {e} has occurred for captions {start} to {start + len(batch)}")
+                continue
+
+            self.cache.put_many([keys[index] for index in batch_indexes], vectors)
+            dim = vectors.shape[1]
+            for index, vector in zip(batch_indexes, vectors):
+                computed[index] = vector
+
+        matrix = np.full((nb_embed, dim or self.output_dimensionality or EMBEDDING_DIM), np.nan, dtype=np.float32)
+        for index, vector in enumerate(cached):
+            if vector is not None:
+                matrix[index] = vector
+        for index, vector in computed.items():
+            matrix[index] = vector
+        return matrix
 
-        return results
-    
     def double_embedding_test(self, gemini_caption, hf_caption):
         try:
-            time.sleep(4)  # Delay before the first API call
-            gemini_embedding = self.get_embedding(gemini_caption)
-
-            time.sleep(4)  # Delay before the second API call
-            hf_embedding = self.get_embedding(hf_caption)
+            # Delay before each API call, skipped when the caption is already cached
+            gemini_embedding = self.get_embedding(gemini_caption, delay=4)
+            hf_embedding = self.get_embedding(hf_caption, delay=4)
 
             if gemini_embedding is None or hf_embedding is None:
                 raise ValueError("One or both embeddings are invalid.")
 
             # Validate embedding dimensions
-            if gemini_embedding.shape[0] != 3072 or hf_embedding.shape[0] != 3072:  # Adjust dimension as needed
+            expected_dim = self.output_dimensionality or EMBEDDING_DIM
+            if gemini_embedding.shape[0] != expected_dim or hf_embedding.shape[0] != expected_dim:
                 raise ValueError(f"Unexpected embedding shape: Gemini - {gemini_embedding.shape}, HF - {hf_embedding.shape}")
 
             return gemini_embedding, hf_embedding
         except Exception as e:
             print(f"Error generating double embedding: {e}")
-            return None, None
\ No newline at end of file
+            return None, None
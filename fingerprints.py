@@ -0,0 +1,78 @@
+import os
+from hashlib import md5
+from concurrent.futures import ThreadPoolExecutor
+
+from db_connection import get_writer
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.heic')
+
+
+def file_md5(path, chunk_size=1 << 20):
+    """Computes the MD5 of a file by streaming it in chunks instead of reading it whole."""
+    digest = md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ensure_fingerprint_table(conn):
+    """Creates the fingerprints table mapping (path, size, mtime_ns, inode) to the file's md5."""
+    writer = get_writer(conn)
+    writer.execute("""
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            md5 TEXT NOT NULL
+        )
+    """)
+    writer.flush()
+
+
+def fingerprint_files(conn, paths, workers=4):
+    """
+    Returns a dict {path: md5} for the given files.
+    Files whose size, mtime and inode did not change since the last run reuse the stored md5,
+    only new or modified files are read and hashed (in parallel). The new md5s are saved by the
+    database's writer thread.
+    """
+    ensure_fingerprint_table(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT path, size, mtime_ns, inode, md5 FROM fingerprints")
+    known = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    hashes = {}
+    stale = []
+    for path in paths:
+        st = os.stat(path)
+        stat_key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        cached = known.get(path)
+        if cached is not None and tuple(cached[:3]) == stat_key:
+            hashes[path] = cached[3]
+        else:
+            stale.append((path, stat_key))
+
+    if stale:
+        print(f"Hashing {len(stale)} new or modified files ({len(hashes)} unchanged)...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            digests = list(executor.map(file_md5, [path for path, _ in stale]))
+        get_writer(conn).executemany(
+            "INSERT OR REPLACE INTO fingerprints (path, size, mtime_ns, inode, md5) VALUES (?, ?, ?, ?, ?)",
+            [(path, *stat_key, digest) for (path, stat_key), digest in zip(stale, digests)]
+        )
+        for (path, _), digest in zip(stale, digests):
+            hashes[path] = digest
+
+    return hashes
+
+
+def fingerprint_directory(conn, directory, extensions=IMAGE_EXTENSIONS, workers=4):
+    """Fingerprints every image of `directory`, returns a dict {full_path: md5} in listing order."""
+    paths = [
+        os.path.join(directory, filename) for filename in os.listdir(directory)
+        if filename.lower().endswith(extensions)
+    ]
+    hashes = fingerprint_files(conn, paths, workers=workers)
+    return {path: hashes[path] for path in paths}
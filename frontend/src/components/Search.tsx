@@ -3,6 +3,8 @@ import React, { useState } from 'react';
 interface SearchResult {
   md5: string;
   file_path: string;
+  thumbnail_url?: string;
+  thumbnails?: Record<string, string>;
   description: string;
   distance: number;
 }
@@ -60,7 +62,16 @@ const Search: React.FC = () => {
         {results.map((result) => (
           <div key={result.md5} className="result-card">
             <img
-              src={result.file_path}
+              src={result.thumbnail_url || result.file_path}
+              srcSet={
+                result.thumbnails
+                  ? Object.entries(result.thumbnails)
+                      .map(([size, url]) => `${url} ${size}w`)
+                      .join(', ')
+                  : undefined
+              }
+              sizes="320px"
+              loading="lazy"
               alt={result.description}
               className="result-image"
               onError={(e) => {
@@ -4,19 +4,27 @@ import PIL.Image
 import numpy as np
 import time
 import google.api_core.exceptions
-from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
+
+# Rough token cost of one captioning request: Gemini bills a fixed 258 tokens per image
+# plus the prompt and the short caption that comes back
+IMAGE_TOKENS = 258
+CAPTION_TOKENS = 50
 
 class ModelApi():
-    def __init__(self, init_hf=False):
+    def __init__(self, init_hf=False, rate_limiter=None, hf_batch_size=8, torch_threads=None):
         # Initialize the Gemini API client
         config = dotenv_values(".env")
         self.__client = genai.Client(api_key=config.get("API_KEY"))
+        # Shared RateLimiter, when None we fall back to a fixed delay between requests
+        self.rate_limiter = rate_limiter
         
         if init_hf:
             # Initialize the Hugging Face model, processor, and tokenizer
-            self.hf_model = VisionEncoderDecoderModel.from_pretrained("ydshieh/vit-gpt2-coco-en")
-            self.processor = ViTImageProcessor.from_pretrained("ydshieh/vit-gpt2-coco-en")
-            self.tokenizer = AutoTokenizer.from_pretrained("ydshieh/vit-gpt2-coco-en") 
+            from hf_captioner import BatchCaptioner
+            self.captioner = BatchCaptioner(batch_size=hf_batch_size, num_threads=torch_threads)
+            self.hf_model = self.captioner.model
+            self.processor = self.captioner.processor
+            self.tokenizer = self.captioner.tokenizer
 
     def textQuery(self, text="Explain how AI works"):
         response = self.__client.models.generate_content(
@@ -26,6 +34,13 @@ class ModelApi():
         print(response.text)
         return response.text
 
+    def _throttle(self, prompt):
+        """Waits until the next Gemini request is allowed."""
+        if self.rate_limiter is None:
+            time.sleep(4)  # 4s delay to stay within ~15 requests/min
+        else:
+            self.rate_limiter.acquire(IMAGE_TOKENS + len(prompt) // 4 + CAPTION_TOKENS)
+
     def imageQuery(self, image_path, prompt):
         """
         Processes an image and generates a text response based on a prompt using the Gemini model.
@@ -45,7 +60,7 @@ class ModelApi():
         except Exception as e:
             print(f"Error opening emage: {e}")
             return None
-        time.sleep(4)
+        self._throttle(prompt)
 
         try:
             response = self.__client.models.generate_content(
@@ -74,15 +89,15 @@ class ModelApi():
             The generated caption.
         """
         try:
-            # Open the image and preprocess it
-            image = PIL.Image.open(image_path).convert("RGB")
-            inputs = self.processor(images=image, return_tensors="pt")
-
-            # Generate the caption
-            output_ids = self.hf_model.generate(inputs.pixel_values)
-            caption = self.tokenizer.decode(output_ids[0], skip_special_tokens=True)
-            return caption
+            return self.captioner.caption_image(image_path)
         except Exception as e:
             print(f"Error generating Hugging Face caption for {image_path}: {e}")
             return None
 
+    def huggingfaceQueryBatch(self, image_paths):
+        """
+        Generates the Hugging Face captions of many images in batches.
+        Returns a dict image path -> caption (None when it failed).
+        """
+        return self.captioner.caption_files(image_paths)
+
@@ -0,0 +1,147 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import PIL.Image
+import torch
+from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
+
+HF_MODEL_NAME = "ydshieh/vit-gpt2-coco-en"
+
+
+class BatchCaptioner:
+    """
+    Batched CPU inference for the ViT-GPT2 captioner.
+    Images are decoded and preprocessed by a thread pool while the previous batch is generated,
+    generation runs under torch.inference_mode with `num_threads` intra-op threads.
+    Generation settings are the same as a single-image call, the first call of caption_files checks
+    on one batch that the captions do not change and falls back to one image at a time if they do.
+    """
+
+    def __init__(self, model=None, processor=None, tokenizer=None, batch_size=8, workers=4, num_threads=None):
+        self.model = model or VisionEncoderDecoderModel.from_pretrained(HF_MODEL_NAME)
+        self.processor = processor or ViTImageProcessor.from_pretrained(HF_MODEL_NAME)
+        self.tokenizer = tokenizer or AutoTokenizer.from_pretrained(HF_MODEL_NAME)
+        self.model.eval()
+        self.batch_size = batch_size
+        self.workers = workers
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        # generate is not re-entrant across threads, callers from a thread pool share one model
+        self.lock = threading.Lock()
+        # Set by the first caption_files call, see verify_batching
+        self.batching_ok = None
+
+    def _preprocess(self, image_path):
+        try:
+            image = PIL.Image.open(image_path).convert("RGB")
+            return self.processor(images=image, return_tensors="pt").pixel_values[0]
+        except Exception as e:
+            print(f"Error loading {image_path} for captioning: {e}")
+            return None
+
+    def _generate(self, pixel_values):
+        with self.lock, torch.inference_mode():
+            output_ids = self.model.generate(pixel_values)
+        return self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+    def caption_image(self, image_path):
+        """Caption of a single image, None if it could not be read."""
+        pixel_values = self._preprocess(image_path)
+        if pixel_values is None:
+            return None
+        return self._generate(pixel_values[None])[0]
+
+    def verify_batching(self, image_paths, sample=None):
+        """
+        Captions the first `sample` images (one batch by default) one at a time and batched.
+        Returns both dicts path -> caption, they are equal when batching does not change the captions.
+        """
+        sample_paths = list(image_paths)[:sample or self.batch_size]
+        single = {path: self.caption_image(path) for path in sample_paths}
+        return single, self._caption_batches(sample_paths)
+
+    def caption_files(self, image_paths):
+        """
+        Captions many images, `batch_size` at a time. Returns a dict path -> caption,
+        None for the images that could not be read or captioned.
+        """
+        image_paths = list(image_paths)
+        captions = {}
+        if self.batching_ok is None and image_paths:
+            captions, batched = self.verify_batching(image_paths)
+            self.batching_ok = captions == batched
+            for path in captions:
+                if captions[path] != batched[path]:
+                    print(f"Batched caption of {path} differs: {captions[path]!r} != {batched[path]!r}")
+            if not self.batching_ok:
+                print("Batched captions differ from single-image ones, captioning one image at a time")
+        remaining = [path for path in image_paths if path not in captions]
+        if not self.batching_ok:
+            captions.update((path, self.caption_image(path)) for path in remaining)
+            return captions
+        captions.update(self._caption_batches(remaining))
+        return captions
+
+    def _caption_batches(self, image_paths):
+        """Batched captioning without the check of caption_files."""
+        batches = [image_paths[start:start + self.batch_size] for start in range(0, len(image_paths), self.batch_size)]
+        captions = {}
+        start_time = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Preprocessing of the next batch is already queued while the current one is generated
+            pending = [executor.map(self._preprocess, batch) for batch in batches[:2]]
+            for index, batch in enumerate(batches):
+                tensors = list(pending.pop(0))
+                if index + 2 < len(batches):
+                    pending.append(executor.map(self._preprocess, batches[index + 2]))
+
+                valid = [i for i, tensor in enumerate(tensors) if tensor is not None]
+                captions.update(dict.fromkeys(batch))
+                if not valid:
+                    continue
+                try:
+                    texts = self._generate(torch.stack([tensors[i] for i in valid]))
+                except Exception as e:
+                    print(f"Error generating Hugging Face captions for batch {index}: {e}")
+                    continue
+                for i, text in zip(valid, texts):
+                    captions[batch[i]] = text
+                print(f"Captioned {min((index + 1) * self.batch_size, len(image_paths))}/{len(image_paths)} images")
+
+        elapsed = time.perf_counter() - start_time
+        if image_paths and elapsed > 0:
+            print(f"Hugging Face captioning: {len(image_paths)} images in {elapsed:.1f}s ({len(image_paths) / elapsed:.2f} images/sec)")
+        return captions
+
+
+if __name__ == "__main__":
+    # Checks the batched path against one image at a time on a folder and compares the throughput
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Compare batched and single-image ViT-GPT2 captioning.")
+    parser.add_argument("--image-dir", default="data/tests")
+    parser.add_argument("--limit", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.image_dir, filename) for filename in os.listdir(args.image_dir)
+        if filename.lower().endswith(('.png', '.jpg', '.jpeg'))
+    )[:args.limit]
+    captioner = BatchCaptioner(batch_size=args.batch_size, num_threads=args.threads)
+
+    start_time = time.perf_counter()
+    single = {path: captioner.caption_image(path) for path in paths}
+    elapsed = time.perf_counter() - start_time
+    print(f"One image at a time: {len(paths) / elapsed:.2f} images/sec")
+
+    # The batched pass prints its own images/sec
+    batched = captioner._caption_batches(paths)
+    mismatches = [path for path in paths if single[path] != batched[path]]
+    print(f"{len(paths) - len(mismatches)}/{len(paths)} identical captions")
+    for path in mismatches:
+        print(f"{path}: {single[path]!r} != {batched[path]!r}")
@@ -0,0 +1,140 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+# Errors kept per job, the count goes on after that
+MAX_ERRORS = 50
+
+
+class Job:
+    """
+    A background ingest job. The task updates `processed` / `total` through update(),
+    reports per-item errors with add_error() and stops early once `cancelled` is set.
+    """
+
+    def __init__(self, kind, params=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        self.status = QUEUED
+        self.processed = 0
+        self.total = None
+        self.errors = []
+        self.error_count = 0
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def update(self, processed=None, total=None):
+        with self.lock:
+            if processed is not None:
+                self.processed = processed
+            if total is not None:
+                self.total = total
+
+    def add_error(self, message):
+        with self.lock:
+            self.error_count += 1
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append(str(message))
+
+    def to_dict(self):
+        with self.lock:
+            now = self.finished_at or time.time()
+            elapsed = now - self.started_at if self.started_at else 0.0
+            rate = self.processed / elapsed if elapsed > 0 else 0.0
+            eta = None
+            if self.status == RUNNING and self.total is not None and rate > 0:
+                eta = max(self.total - self.processed, 0) / rate
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "params": self.params,
+                "status": self.status,
+                "processed": self.processed,
+                "total": self.total,
+                "rate_per_second": rate,
+                "eta_seconds": eta,
+                "elapsed_seconds": elapsed,
+                "error_count": self.error_count,
+                "errors": list(self.errors),
+                "result": self.result,
+                "created_at": self.created_at,
+            }
+
+
+class JobQueue:
+    """
+    Runs jobs on a bounded pool of worker threads, separate from the threads serving requests.
+    Finished jobs are kept for /jobs/{id} until `max_jobs` newer ones pushed them out.
+    """
+
+    def __init__(self, max_workers=2, max_jobs=1000):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, kind, task, params=None):
+        """Queues task(job) and returns the job at once."""
+        job = Job(kind, params)
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                oldest = next(iter(self.jobs.values()))
+                if oldest.status in (QUEUED, RUNNING):
+                    break
+                self.jobs.popitem(last=False)
+        self.executor.submit(self._run, job, task)
+        return job
+
+    def _run(self, job, task):
+        with job.lock:
+            if job.cancelled:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+        try:
+            result = task(job)
+            status = CANCELLED if job.cancelled else DONE
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.add_error(e)
+            result, status = str(e), FAILED
+        with job.lock:
+            job.result = result
+            job.status = status
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        """Asks a job to stop, a queued job never starts. Returns the job or None."""
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel_event.set()
+        return job
+
+    def shutdown(self):
+        """Cancels every job and waits for the running ones to stop."""
+        for job in self.list():
+            job.cancel_event.set()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,90 @@
+"""
+BM25 search over the captions with an SQLite FTS5 index, and reciprocal-rank fusion with the vector results.
+
+images_fts is an external content FTS5 table over images.label: it stores only the inverted index,
+triggers on images keep it in sync with every insert, update and delete.
+"""
+import re
+import sqlite3
+
+# Constant of reciprocal-rank fusion, 60 is the value of the original paper
+RRF_K = 60
+
+
+def ensure_fts_index(conn):
+    """
+    Creates the FTS5 index and its triggers, (re)building the index when they were missing.
+    Returns False when this SQLite build has no FTS5, the searches then stay vector only.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'images_fts_%'")
+    complete = cursor.fetchone()[0] == 3
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+                label, content='images', content_rowid='rowid', tokenize='porter unicode61'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"Lexical search disabled, SQLite has no FTS5: {e}")
+        return False
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN
+            INSERT INTO images_fts (rowid, label) VALUES (new.rowid, new.label);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN
+            INSERT INTO images_fts (images_fts, rowid, label) VALUES ('delete', old.rowid, old.label);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE ON images BEGIN
+            INSERT INTO images_fts (images_fts, rowid, label) VALUES ('delete', old.rowid, old.label);
+            INSERT INTO images_fts (rowid, label) VALUES (new.rowid, new.label);
+        END
+    """)
+    if not complete:
+        # New index, or the images table was rebuilt (migrate_db) and lost its triggers
+        cursor.execute("INSERT INTO images_fts (images_fts) VALUES ('rebuild')")
+        print("Built the full-text index of the captions.")
+    conn.commit()
+    return True
+
+
+def fts_query(text):
+    """FTS5 MATCH expression of free text: any of its words, each quoted so no word is read as an operator."""
+    words = re.findall(r"\w+", text.lower())
+    return " OR ".join(f'"{word}"' for word in words)
+
+
+def lexical_search(conn, text, limit=10, offset=0):
+    """
+    Captions matching `text` ranked by BM25 (the default rank of FTS5), one row per md5.
+    Returns (md5, image_path, label, score) rows, higher scores are better matches.
+    """
+    match = fts_query(text)
+    if not match:
+        return []
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT md5, image_path, label, -MIN(score) FROM (
+            SELECT i.md5, i.image_path, i.label, f.rank AS score
+            FROM images_fts f JOIN images i ON i.rowid = f.rowid
+            WHERE images_fts MATCH ? AND i.md5 IS NOT NULL
+        )
+        GROUP BY md5 ORDER BY MIN(score) LIMIT ? OFFSET ?
+    """, (match, limit, offset))
+    return cursor.fetchall()
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses ranked lists of ids: each id scores the sum of 1 / (k + rank) over the lists it appears in.
+    Returns (id, score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,289 @@
+import os
+import threading
+
+import numpy as np
+
+from db_connection import connect
+
+
+def exact_top_k(queries, matrix, k, sq_norms=None, alive=None, block_rows=65536):
+    """
+    Exact L2 top-k of every query against the rows of `matrix`, computed block by block
+    with a matrix multiply and np.argpartition so the whole distance matrix is never built.
+    Returns (distances, rows), both of shape (nb_queries, k') sorted by increasing distance,
+    with k' = min(k, number of candidate rows). Distances are squared L2 like Milvus returns.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    nb_rows = matrix.shape[0]
+    best_distances = np.empty((queries.shape[0], 0), dtype=np.float32)
+    best_rows = np.empty((queries.shape[0], 0), dtype=np.int64)
+    if nb_rows == 0 or k <= 0:
+        return best_distances, best_rows
+
+    query_sq_norms = np.einsum("ij,ij->i", queries, queries)
+    for start in range(0, nb_rows, block_rows):
+        end = min(start + block_rows, nb_rows)
+        block = np.asarray(matrix[start:end], dtype=np.float32)
+        block_sq_norms = sq_norms[start:end] if sq_norms is not None else np.einsum("ij,ij->i", block, block)
+        distances = query_sq_norms[:, None] - 2.0 * (queries @ block.T) + block_sq_norms[None, :]
+        if alive is not None:
+            distances[:, ~alive[start:end]] = np.inf
+
+        block_k = min(k, end - start)
+        candidates = np.argpartition(distances, block_k - 1, axis=1)[:, :block_k]
+        candidate_distances = np.take_along_axis(distances, candidates, axis=1)
+
+        merged_distances = np.concatenate([best_distances, candidate_distances], axis=1)
+        merged_rows = np.concatenate([best_rows, candidates + start], axis=1)
+        keep = min(k, merged_distances.shape[1])
+        selected = np.argpartition(merged_distances, keep - 1, axis=1)[:, :keep]
+        best_distances = np.take_along_axis(merged_distances, selected, axis=1)
+        best_rows = np.take_along_axis(merged_rows, selected, axis=1)
+
+    order = np.argsort(best_distances, axis=1, kind="stable")
+    best_distances = np.maximum(np.take_along_axis(best_distances, order, axis=1), 0.0)
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+    return best_distances, best_rows
+
+
+def truncate_embeddings(vectors, dim):
+    """
+    Keeps the first `dim` components of Matryoshka-style embeddings and L2-normalizes them again,
+    the prefix of a Gemini embedding is itself a usable lower dimensional embedding.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))[:, :dim]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+class LocalHit:
+    """Mimics a pymilvus Hit: `id`, `distance` and an `entity` answering .get(field)."""
+
+    def __init__(self, md5, distance, entity):
+        self.id = md5
+        self.pk = md5
+        self.distance = distance
+        self.score = distance
+        self.entity = entity
+
+    def __repr__(self):
+        return f"LocalHit(id={self.id!r}, distance={self.distance}, entity={self.entity})"
+
+
+class LocalVectorDb:
+    """
+    Exact vector search backend with the same methods as vector_db.MilvusDb, for dev boxes,
+    CI and small deployments. Vectors live in a memory-mapped float32 .npy matrix, the md5,
+    file path and description of each row in a small SQLite file next to it.
+    """
+
+    def __init__(self, collection_name="image_embeddings", dim=3072, root_dir="local_vectors"):
+        self.collection_name = collection_name
+        self.dim = dim
+        self.directory = os.path.join(root_dir, collection_name)
+        os.makedirs(self.directory, exist_ok=True)
+        self.vectors_path = os.path.join(self.directory, "vectors.npy")
+        self.lock = threading.RLock()
+
+        self.conn = connect(os.path.join(self.directory, "records.db"), check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                row INTEGER PRIMARY KEY,
+                md5 TEXT UNIQUE NOT NULL,
+                file_path TEXT,
+                description TEXT
+            )
+        """)
+        self.conn.commit()
+
+        rows = self.conn.execute("SELECT row, md5, file_path, description FROM records ORDER BY row").fetchall()
+        self.size = rows[-1][0] + 1 if rows else 0
+        if os.path.isfile(self.vectors_path):
+            self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+            if self.vectors.shape[1] != dim:
+                raise ValueError(f"{self.vectors_path} holds {self.vectors.shape[1]}-d vectors, expected {dim}")
+        else:
+            self.vectors = np.lib.format.open_memmap(self.vectors_path, mode="w+", dtype=np.float32, shape=(1024, dim))
+
+        capacity = self.vectors.shape[0]
+        self.md5s = [None] * capacity
+        self.file_paths = [None] * capacity
+        self.descriptions = [None] * capacity
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.rows_by_md5 = {}
+        for row, md5, file_path, description in rows:
+            self.md5s[row], self.file_paths[row], self.descriptions[row] = md5, file_path, description
+            self.alive[row] = True
+            self.rows_by_md5[md5] = row
+
+        self.sq_norms = np.zeros(capacity, dtype=np.float32)
+        for start in range(0, self.size, 65536):
+            block = np.asarray(self.vectors[start:min(start + 65536, self.size)])
+            self.sq_norms[start:start + len(block)] = np.einsum("ij,ij->i", block, block)
+        print(f"Opened local vector collection '{collection_name}' with {len(self.rows_by_md5)} records.")
+
+    def _grow(self, needed):
+        """Reallocates the memory-mapped matrix with at least `needed` rows."""
+        capacity = self.vectors.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, 2 * capacity)
+        tmp_path = self.vectors_path + ".tmp.npy"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(new_capacity, self.dim))
+        used = min(self.size, capacity)
+        grown[:used] = self.vectors[:used]
+        grown.flush()
+        del grown
+        del self.vectors
+        os.replace(tmp_path, self.vectors_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+
+        extra = new_capacity - capacity
+        self.md5s.extend([None] * extra)
+        self.file_paths.extend([None] * extra)
+        self.descriptions.extend([None] * extra)
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+        self.sq_norms = np.concatenate([self.sq_norms, np.zeros(extra, dtype=np.float32)])
+
+    def create_index(self, rebuild=False):
+        # Exact search, nothing to build
+        pass
+
+    def tune_search_params(self, sample_size=200, k=10, target_recall=0.95):
+        print("The local backend searches exactly, nothing to tune.")
+        return None
+
+    def flush(self):
+        with self.lock:
+            self.vectors.flush()
+            self.conn.commit()
+
+    def insert_record(self, md5, file_path, description, embedding):
+        if not isinstance(embedding, (list, np.ndarray)) or len(embedding) != self.dim:
+            print(f"Invalid embedding for {file_path}. Skipping insertion.")
+            return
+        return self.insert_many([md5], [file_path], [description], np.asarray(embedding, dtype=np.float32)[None, :])
+
+    def insert_many(self, md5s, file_paths, descriptions, embeddings, max_batch_bytes=None):
+        """Inserts or replaces many records, `embeddings` is an (N, dim) matrix."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected an (N, {self.dim}) embedding matrix, got {embeddings.shape}")
+        if not (len(md5s) == len(file_paths) == len(descriptions) == embeddings.shape[0]):
+            raise ValueError("md5s, file_paths, descriptions and embeddings must have the same length")
+
+        with self.lock:
+            rows = []
+            for md5 in md5s:
+                row = self.rows_by_md5.get(md5)
+                if row is None:
+                    row = self.size
+                    self.size += 1
+                    self.rows_by_md5[md5] = row
+                rows.append(row)
+            self._grow(self.size)
+
+            rows = np.array(rows, dtype=np.int64)
+            self.vectors[rows] = embeddings
+            self.sq_norms[rows] = np.einsum("ij,ij->i", embeddings, embeddings)
+            self.alive[rows] = True
+            for row, md5, file_path, description in zip(rows.tolist(), md5s, file_paths, descriptions):
+                self.md5s[row], self.file_paths[row], self.descriptions[row] = md5, file_path, description
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO records (row, md5, file_path, description) VALUES (?, ?, ?, ?)",
+                list(zip(rows.tolist(), md5s, file_paths, descriptions))
+            )
+            self.flush()
+        return len(rows)
+
+    def delete_record(self, md5):
+        with self.lock:
+            row = self.rows_by_md5.pop(md5, None)
+            if row is not None:
+                self.alive[row] = False
+                self.conn.execute("DELETE FROM records WHERE row = ?", (row,))
+                self.conn.commit()
+        print(f"Deleted record with md5: {md5}")
+
+    def update_description(self, md5: str, new_description: str):
+        """
+        Update the 'description' field of the record with the given md5.
+        """
+        with self.lock:
+            row = self.rows_by_md5.get(md5)
+            if row is None:
+                print(f"No record found with md5 '{md5}'.")
+                return None
+            self.descriptions[row] = new_description
+            self.conn.execute("UPDATE records SET description = ? WHERE row = ?", (new_description, row))
+            self.conn.commit()
+        print(f"Updated description for md5 '{md5}'.")
+        return {"upsert_count": 1}
+
+    def search_by_embedding(self, query_embedding, limit=10, output_fields=("md5", "file_path", "description"), offset=0, search_params=None):
+        """
+        Exact top-`limit` search after skipping the first `offset` hits. Accepts one query vector or an
+        (nb_queries, dim) matrix and, like collection.search, returns one list of hits per query.
+        The search is exact, `search_params` is accepted for compatibility and ignored.
+        """
+        queries = np.atleast_2d(np.asarray(query_embedding, dtype=np.float32))
+        with self.lock:
+            distances, rows = exact_top_k(
+                queries, self.vectors[:self.size], offset + limit,
+                sq_norms=self.sq_norms[:self.size], alive=self.alive[:self.size]
+            )
+            columns = {"md5": self.md5s, "file_path": self.file_paths, "description": self.descriptions}
+            results = []
+            for query_distances, query_rows in zip(distances.tolist(), rows.tolist()):
+                hits = []
+                for distance, row in zip(query_distances[offset:], query_rows[offset:]):
+                    if distance == np.inf:
+                        continue
+                    entity = {field: columns[field][row] for field in output_fields}
+                    hits.append(LocalHit(self.md5s[row], distance, entity))
+                results.append(hits)
+        return results
+
+    def search_many(self, query_embeddings, limit=10, output_fields=("md5",), batch_size=1000, search_params=None):
+        """Same as MilvusDb.search_many, one list of hits per query."""
+        results = []
+        for start in range(0, len(query_embeddings), batch_size):
+            results.extend(self.search_by_embedding(query_embeddings[start:start + batch_size], limit, output_fields))
+        return results
+
+    def exact_search_md5s(self, query_embeddings, limit=10):
+        """This backend is exact already, same as search_many but only returns the md5s."""
+        return [[hit.id for hit in hits] for hits in self.search_many(query_embeddings, limit)]
+
+    def get_vectors(self, md5s):
+        """Returns the stored vectors of `md5s` as an (N, dim) matrix and a mask of the md5s found."""
+        with self.lock:
+            rows = np.array([self.rows_by_md5.get(md5, -1) for md5 in md5s], dtype=np.int64)
+            found = rows >= 0
+            vectors = np.zeros((len(md5s), self.dim), dtype=np.float32)
+            vectors[found] = self.vectors[rows[found]]
+        return vectors, found
+
+    def get_by_md5(self, md5: str):
+        """
+        Retrieve a single record matching the given md5.
+        """
+        with self.lock:
+            row = self.rows_by_md5.get(md5)
+            if row is None:
+                print(f"No record found for md5 '{md5}'.")
+                return None
+            return {
+                "md5": md5,
+                "file_path": self.file_paths[row],
+                "description": self.descriptions[row],
+                "embedding": np.array(self.vectors[row]).tolist()
+            }
+
+    def count(self):
+        with self.lock:
+            return len(self.rows_by_md5)
+
+    def get_all_md5_hashes(self):
+        with self.lock:
+            return list(self.rows_by_md5)
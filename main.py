@@ -1,13 +1,15 @@
 import argparse
-from PIL.Image import init
-import gemini_api as ga
-import embeddings as emb
+import os
 from db import *
-import vector_db as vd
-from post_test_score import *
+from pipeline_state import stage_counts
+from db_connection import get_writer
+from rate_limiter import RateLimiter
 import numpy as np
 import time
 
+# The Gemini, Hugging Face and Milvus clients take seconds to import, each option below
+# only imports the modules it uses so e.g. --show-db or --reset start instantly.
+
 def main():
     parser = argparse.ArgumentParser(
         description="Run label creation, text embedding, or post-testing operations."
@@ -32,6 +34,11 @@ def main():
         action="store_true",
         help="Run post-testing evaluation (compare Gemini and other model captions)."
     )
+    parser.add_argument(
+        "--cross-similarity",
+        action="store_true",
+        help="With --post-test, also compare every Gemini embedding with every Hugging Face one (quadratic in the number of images)."
+    )
     parser.add_argument(
         "--sample-coco",
         action="store_true",
@@ -43,6 +50,36 @@ def main():
         default="data/coco_validation_2017/val2017",
         help="Directory containing images for label creation (default: images/)."
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of images captioned concurrently by --create-label and --create-label-tests (default: 1)."
+    )
+    parser.add_argument(
+        "--hf-batch-size",
+        type=int,
+        default=8,
+        help="Images per batch for the local ViT-GPT2 captioner (default: 8)."
+    )
+    parser.add_argument(
+        "--torch-threads",
+        type=int,
+        default=None,
+        help="Intra-op threads used by the local captioner (default: PyTorch's default)."
+    )
+    parser.add_argument(
+        "--rpm",
+        type=int,
+        default=15,
+        help="Gemini requests per minute shared by all workers (default: 15)."
+    )
+    parser.add_argument(
+        "--tpm",
+        type=int,
+        default=None,
+        help="Gemini tokens per minute shared by all workers (default: no limit)."
+    )
     parser.add_argument(
         "--reset",
         action="store_true",
@@ -54,6 +91,29 @@ def main():
         help="Search for the top-k most similar embeddings based on a query prompt."
     )
 
+    parser.add_argument(
+        "--embedding-dtype",
+        choices=["float32", "float16"],
+        default="float32",
+        help="Storage dtype of the embeddings saved by --create-label-tests, float16 halves their size (default: float32)."
+    )
+    parser.add_argument(
+        "--thumbnails",
+        action="store_true",
+        help="Create the missing thumbnails of the labeled images, the server otherwise creates them on first request."
+    )
+    parser.add_argument(
+        "--tune-index",
+        action="store_true",
+        help="Rebuild the Milvus index for the current collection size and auto-tune nprobe/ef for the target recall."
+    )
+    parser.add_argument(
+        "--target-recall",
+        type=float,
+        default=0.95,
+        help="Recall@10 the index auto-tuner has to reach (default: 0.95)."
+    )
+
     parser.add_argument(
         "--migrate-db",
         action="store_true",
@@ -79,15 +139,18 @@ def main():
     prompt = "Generate a short, realistic caption like those in the MS-COCO dataset."
     
     if args.create_label:
+        import gemini_api as ga
         print("Starting the labeling process...")
-        model = ga.ModelApi()
         conn = init_db()
-        label_images(args.dir, model, conn, prompt)
+        model = ga.ModelApi(rate_limiter=RateLimiter(rpm=args.rpm, tpm=args.tpm))
+        label_images_concurrent(args.dir, model, conn, prompt, workers=args.workers)
         conn.close()
         print("Label creation completed.")
 
     if args.small_test:
-        model = ga.ModelApi()
+        import gemini_api as ga
+        import embeddings as emb
+        model = ga.ModelApi(rate_limiter=RateLimiter(rpm=args.rpm, tpm=args.tpm))
         conn = init_db("small_test.db")
         label_images("data/test_subset", model, conn, prompt)
 
@@ -109,10 +172,15 @@ def main():
 
 
     if args.create_label_tests:
+        import gemini_api as ga
+        import embeddings as emb
         print("Starting the labeling process...")
-        model = ga.ModelApi(init_hf=True)
         conn = init_db()
-        label_images_tests('data/tests', model, conn, prompt="Generate a short, realistic caption like those in the MS-COCO dataset.")
+        model = ga.ModelApi(
+            init_hf=True, rate_limiter=RateLimiter(rpm=args.rpm, tpm=args.tpm),
+            hf_batch_size=args.hf_batch_size, torch_threads=args.torch_threads
+        )
+        label_images_tests_concurrent('data/tests', model, conn, prompt, workers=args.workers)
         embedder = emb.Embedder()
         captions = retrieve_captions(conn)
 
@@ -137,7 +205,7 @@ def main():
                         print(f"Invalid embeddings for caption {caption[0]}. Skipping...")
                         continue
 
-                    save_embedding(conn, caption[0], gemini_embed, hf_embed)
+                    save_embedding(conn, caption[0], gemini_embed, hf_embed, dtype=args.embedding_dtype)
                 except Exception as e:
                     print(f"Error processing caption {caption[0]}: {e}")
                     continue
@@ -156,12 +224,13 @@ def main():
                 else:
                     print("Hugging Face embedding is invalid.")
 
-                save_embedding(conn, caption[0], gemini_embed, hf_embed)
+                save_embedding(conn, caption[0], gemini_embed, hf_embed, dtype=args.embedding_dtype)
             except Exception as e:
                 print(f"Error processing caption {caption[0]}: {e}")
                 time.sleep(2)
 
-        # Retrieve and inspect embeddings
+        # Retrieve and inspect embeddings, once the queued writes are committed
+        get_writer(conn).flush()
         try:
             embeddings = retrieve_embeddings(conn)
             for gemini_embedding, huggingface_embedding in embeddings:
@@ -181,45 +250,27 @@ def main():
         return
 
     if args.show_db:
+        import vector_db as vd
         conn = init_db()
         print(len(retrieve_all_images(conn)))
-        vector_db = vd.MilvusDb()
+        print(stage_counts(conn))
+        vector_db = vd.get_vector_db()
         print(len(vector_db.get_all_md5_hashes()))
         
 
     if args.embed_text:
-        milvus_db = vd.MilvusDb()
+        import embeddings as emb
+        import vector_db as vd
+        milvus_db = vd.get_vector_db()
         embedder = emb.Embedder()
-
-        existing_hashes = milvus_db.get_all_md5_hashes()
         conn = init_db()
 
+        # Only the captioned images that are not indexed yet, according to the pipeline state
         try:
-            images = retrieve_images(conn, existing_hashes)
-            print(f"Retrieved images: {images}")  # Debug print
-            conn.close()
+            embed_images(conn, embedder, milvus_db)
         except Exception as e:
             print(e)
-            conn.close()
-            return
-
-
-        nb_images = len(images)
-        nb_done = 0
-        for index in range(len(images)):
-            print(f"Finished the {nb_done} out of {nb_images}")
-            print(f"Embeded caption: {images[index][3]}")
-            nb_done+=1
-            try:
-                time.sleep(4)
-                embedding = embedder.get_embedding(images[index][3])
-                if embedding is not None:
-                  milvus_db.insert_record(images[index][0], images[index][1], images[index][2], embedding)
-                else:
-                  print("Skipped due to None return")
-            except Exception as e:
-                time.sleep(1)
-                print(e)
+        conn.close()
         print("inserted into milvus done")
 
 
@@ -227,13 +278,38 @@ def main():
         res = milvus_db.get_all_md5_hashes()
         print(res)
 
+    if args.thumbnails:
+        from thumbnails import ThumbnailCache
+        conn = init_db()
+        images = conn.execute("SELECT DISTINCT md5, image_path FROM images WHERE md5 IS NOT NULL").fetchall()
+        conn.close()
+        thumbnails = ThumbnailCache()
+        start = time.perf_counter()
+        created, failed = thumbnails.generate_many(images)
+        thumbnails.close()
+        print(f"Created {created} thumbnails ({failed} failed) in {time.perf_counter() - start:.1f}s")
+
+    if args.tune_index:
+        import vector_db as vd
+        vector_db = vd.get_vector_db()
+        vector_db.create_index(rebuild=True)
+        vector_db.tune_search_params(target_recall=args.target_recall)
+
     if args.post_test:
+        from embedding_export import MATRIX_DIR, export_embeddings, load_embedding_matrices
+        from post_test_score import evaluate_embedding_cosine_similarity, evaluate_cross_similarity, evaluate_top_n_similarity
         conn = init_db("labels_raghav.db")
 
-        embeddings = retrieve_embeddings(conn)
+        # Sync the new rows of the embeddings table into contiguous matrices and memory-map them
+        matrix_dir = os.path.join(MATRIX_DIR, "labels_raghav")
+        export_embeddings(conn, out_dir=matrix_dir)
+        conn.close()
+        _, gemini_matrix, huggingface_matrix = load_embedding_matrices(matrix_dir)
 
-        evaluate_embedding_cosine_similarity(embeddings, output_csv="results/similarity_scores_embedding.csv")
-        evaluate_top_n_similarity(embeddings, output_csv="results/similarity_scores_top_n.csv", top_n=10)
+        evaluate_embedding_cosine_similarity(gemini_matrix, huggingface_matrix, output_csv="results/similarity_scores_embedding.csv")
+        if args.cross_similarity:
+            evaluate_cross_similarity(gemini_matrix, huggingface_matrix, output_csv="results/similarity_scores_cross.csv")
+        evaluate_top_n_similarity(gemini_matrix, huggingface_matrix, output_csv="results/similarity_scores_top_n.csv", top_n=10)
        
         
     if args.sample_coco:
@@ -0,0 +1,152 @@
+"""
+Per-image ingest state: every (md5, prompt) goes through hashed -> captioned -> embedded -> indexed.
+Each stage selects its work with an indexed query on the pipeline_state table, failures bump an
+attempt counter and keep the last error, so a run that crashed resumes with only the remaining work.
+The writes go through the database's single writer (db_connection.get_writer).
+"""
+import time
+
+from db_connection import get_writer
+
+HASHED, CAPTIONED, EMBEDDED, INDEXED = 0, 1, 2, 3
+STAGE_NAMES = ("hashed", "captioned", "embedded", "indexed")
+# Images failing a stage this many times are left out until their attempts are reset
+MAX_ATTEMPTS = 5
+
+
+def ensure_pipeline_table(conn):
+    """Creates the state table and catches it up with the captions already in `images` (see sync_captioned)."""
+    writer = get_writer(conn)
+    writer.transaction([
+        ("""
+            CREATE TABLE IF NOT EXISTS pipeline_state (
+                md5 TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                image_path TEXT,
+                stage INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL,
+                PRIMARY KEY (md5, prompt)
+            )
+        """, [()]),
+        ("CREATE INDEX IF NOT EXISTS pipeline_state_stage ON pipeline_state (stage, attempts)", [()]),
+    ])
+    sync_captioned(conn)
+
+
+def sync_captioned(conn):
+    """
+    Moves to the captioned stage the labeled images the state does not know about yet: written to
+    `images` before the state table existed or by another code path (e.g. caption_generator_post),
+    or still at the hashed stage.
+    """
+    now = time.time()
+    writer = get_writer(conn)
+    writer.transaction([
+        ("""
+            INSERT OR IGNORE INTO pipeline_state (md5, prompt, image_path, stage, updated_at)
+            SELECT md5, prompt, image_path, ?, ? FROM images WHERE md5 IS NOT NULL AND label IS NOT NULL
+        """, [(CAPTIONED, now)]),
+        ("""
+            UPDATE pipeline_state SET stage = ?, updated_at = ?
+            WHERE stage = ? AND EXISTS (
+                SELECT 1 FROM images WHERE images.md5 = pipeline_state.md5 AND images.prompt = pipeline_state.prompt
+                AND images.label IS NOT NULL
+            )
+        """, [(CAPTIONED, now, HASHED)]),
+    ])
+    writer.flush()
+
+
+def mark_hashed(conn, hashes, prompt):
+    """Registers the fingerprinted images ({path: md5}) for captioning with `prompt`."""
+    now = time.time()
+    writer = get_writer(conn)
+    writer.transaction([
+        ("INSERT OR IGNORE INTO pipeline_state (md5, prompt, image_path, stage, updated_at) VALUES (?, ?, ?, ?, ?)",
+         [(md5, prompt, path, HASHED, now) for path, md5 in hashes.items()]),
+        # Images captioned by another code path only need their state caught up
+        ("""
+            UPDATE pipeline_state SET stage = ?, updated_at = ?
+            WHERE stage = ? AND prompt = ?
+            AND EXISTS (SELECT 1 FROM images WHERE images.md5 = pipeline_state.md5 AND images.prompt = pipeline_state.prompt)
+        """, [(CAPTIONED, now, HASHED, prompt)]),
+    ])
+    # pending() reads the state right after
+    writer.flush()
+
+
+def pending(conn, stage, prompt=None, max_attempts=MAX_ATTEMPTS):
+    """
+    Work of `stage`: the images that completed the stage before it and failed it fewer than
+    `max_attempts` times. Returns (md5, prompt, image_path, label) rows, label is None before captioning.
+    """
+    query = """
+        SELECT s.md5, s.prompt, s.image_path, i.label FROM pipeline_state s
+        LEFT JOIN images i ON i.md5 = s.md5 AND i.prompt = s.prompt
+        WHERE s.stage = ? AND s.attempts < ?
+    """
+    params = [stage - 1, max_attempts]
+    if prompt is not None:
+        query += " AND s.prompt = ?"
+        params.append(prompt)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def advance_statement(keys, stage):
+    """(sql, rows) moving the (md5, prompt) `keys` to `stage`, to queue with other writes."""
+    return (
+        "UPDATE pipeline_state SET stage = ?, attempts = 0, last_error = NULL, updated_at = ? WHERE md5 = ? AND prompt = ? AND stage < ?",
+        [(stage, time.time(), md5, prompt, stage) for md5, prompt in keys]
+    )
+
+
+def advance(conn, keys, stage):
+    """Moves the (md5, prompt) `keys` to `stage` and clears their failures."""
+    conn.executemany(*advance_statement(keys, stage))
+    conn.commit()
+
+
+def record_failure(conn, keys, error):
+    """
+    Counts a failed attempt at the next stage of the (md5, prompt) `keys`.
+    `conn` is a connection or a db_connection.SQLiteWriter, like for advance.
+    """
+    conn.executemany(
+        "UPDATE pipeline_state SET attempts = attempts + 1, last_error = ?, updated_at = ? WHERE md5 = ? AND prompt = ?",
+        [(str(error), time.time(), md5, prompt) for md5, prompt in keys]
+    )
+    conn.commit()
+
+
+def rewind(conn, stage, to_stage):
+    """
+    Moves every image at `stage` back to `to_stage`, e.g. to index them again into a new vector collection.
+    `conn` is a connection or a db_connection.SQLiteWriter, like for advance.
+    """
+    conn.execute("UPDATE pipeline_state SET stage = ?, updated_at = ? WHERE stage = ?", (to_stage, time.time(), stage))
+    conn.commit()
+
+
+def reset_failures(conn, stage=None):
+    """Lets the images that hit MAX_ATTEMPTS be retried, for one stage or all of them."""
+    if stage is None:
+        conn.execute("UPDATE pipeline_state SET attempts = 0")
+    else:
+        conn.execute("UPDATE pipeline_state SET attempts = 0 WHERE stage = ?", (stage - 1,))
+    conn.commit()
+
+
+def stage_counts(conn, max_attempts=MAX_ATTEMPTS):
+    """Number of images at each stage, plus the ones stuck after `max_attempts` failures."""
+    counts = {name: 0 for name in STAGE_NAMES}
+    counts["failed"] = 0
+    cursor = conn.cursor()
+    cursor.execute("SELECT stage, COUNT(*), SUM(attempts >= ?) FROM pipeline_state GROUP BY stage", (max_attempts,))
+    for stage, count, failed in cursor.fetchall():
+        counts[STAGE_NAMES[stage]] = count
+        counts["failed"] += failed or 0
+    return counts
@@ -1,79 +1,185 @@
 import json
 import csv
+import time
 import numpy as np
-from embedding_utils import embed_text, cosine_similarity
-import vector_db as vd
-from db import init_db
 
 
-def evaluate_embedding_cosine_similarity(embeddings, output_csv="results/similarity_scores_embedding.csv"):
-    all_values = []
+def _row_norms(matrix, block_rows=65536):
+    """L2 norm of every row, computed block by block so a memory-mapped matrix is never fully loaded."""
+    norms = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        norms[start:start + len(block)] = np.sqrt(np.einsum("ij,ij->i", block, block))
+    return norms
 
-    for index in range(len(embeddings)):
-        if index >= len(embeddings) or embeddings[index] is None:
-            print(f"Skipping image {index} due to missing or invalid embedding.")
-            continue
 
-        # Store cosine similarity as a dictionary
-        cosine_sim = cosine_similarity(embeddings[index][0], embeddings[index][1])
-        all_values.append({"index": index, "cosine_similarity": cosine_sim})
+def _normalized_block(matrix, norms, start, end):
+    block = np.asarray(matrix[start:end], dtype=np.float32)
+    block_norms = norms[start:end, None]
+    return np.divide(block, block_norms, out=np.zeros_like(block), where=block_norms > 0)
 
-    if not all_values:
+
+def evaluate_embedding_cosine_similarity(gemini_embeddings, hf_embeddings, output_csv="results/similarity_scores_embedding.csv", block_rows=65536):
+    """
+    Cosine similarity between the Gemini and Hugging Face embedding of each image, computed as a
+    row-wise dot product over the two (N, dim) matrices with precomputed norms.
+    Rows are processed and written to the CSV block by block.
+    """
+    if len(gemini_embeddings) == 0 or len(gemini_embeddings) != len(hf_embeddings):
         print("No valid embeddings to evaluate. Skipping CSV generation.")
         return
 
+    start_time = time.perf_counter()
+    gemini_norms = _row_norms(gemini_embeddings, block_rows)
+    hf_norms = _row_norms(hf_embeddings, block_rows)
+    nb_rows = len(gemini_embeddings)
+
     try:
         with open(output_csv, "w", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=["index", "cosine_similarity"])
-            writer.writeheader()
-            writer.writerows(all_values)
+            writer = csv.writer(f)
+            writer.writerow(["index", "cosine_similarity"])
+            for start in range(0, nb_rows, block_rows):
+                end = min(start + block_rows, nb_rows)
+                gemini_block = np.asarray(gemini_embeddings[start:end], dtype=np.float32)
+                hf_block = np.asarray(hf_embeddings[start:end], dtype=np.float32)
+                dots = np.einsum("ij,ij->i", gemini_block, hf_block)
+                norms = gemini_norms[start:end] * hf_norms[start:end]
+                similarities = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+                writer.writerows(zip(range(start, end), similarities.tolist()))
         print(f"Saved cosine similarity results to {output_csv}")
     except Exception as e:
         print(f"Error saving results to CSV: {e}")
+    print(f"Evaluated {nb_rows} pairs in {time.perf_counter() - start_time:.2f}s")
+
+
+def evaluate_cross_similarity(gemini_embeddings, hf_embeddings, output_csv="results/similarity_scores_cross.csv", block_rows=1024, matrix_path=None):
+    """
+    Full N x N cosine similarity between every Gemini caption and every Hugging Face caption,
+    computed in (block_rows x block_rows) tiles so memory stays bounded whatever N is.
+    The CSV gets one line per Gemini caption as its row block finishes: the similarity with its own
+    Hugging Face caption, the best matching Hugging Face caption and the rank of its own caption
+    among all of them (0 = best). If `matrix_path` is given the whole matrix is also written
+    to that .npy file through a memory map.
+    """
+    nb_rows = len(gemini_embeddings)
+    if nb_rows == 0 or nb_rows != len(hf_embeddings):
+        print("No valid embeddings to evaluate. Skipping CSV generation.")
+        return
+
+    start_time = time.perf_counter()
+    gemini_norms = _row_norms(gemini_embeddings)
+    hf_norms = _row_norms(hf_embeddings)
+    full_matrix = None
+    if matrix_path:
+        full_matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.float32, shape=(nb_rows, nb_rows))
+
+    try:
+        with open(output_csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["index", "own_similarity", "best_match_index", "best_match_similarity", "own_rank"])
+            for row_start in range(0, nb_rows, block_rows):
+                row_end = min(row_start + block_rows, nb_rows)
+                gemini_block = _normalized_block(gemini_embeddings, gemini_norms, row_start, row_end)
+                own = None
+                best_index = np.zeros(row_end - row_start, dtype=np.int64)
+                best_similarity = np.full(row_end - row_start, -np.inf, dtype=np.float32)
+                own_rank = np.zeros(row_end - row_start, dtype=np.int64)
+
+                # Diagonal tile first so the own similarities come from the same matrix product as the others
+                col_starts = [row_start] + [col for col in range(0, nb_rows, block_rows) if col != row_start]
+                for col_start in col_starts:
+                    col_end = min(col_start + block_rows, nb_rows)
+                    similarities = gemini_block @ _normalized_block(hf_embeddings, hf_norms, col_start, col_end).T
+                    if own is None:
+                        own = np.diagonal(similarities).copy()
+                    if full_matrix is not None:
+                        full_matrix[row_start:row_end, col_start:col_end] = similarities
+                    block_best = similarities.argmax(axis=1)
+                    block_best_similarity = similarities[np.arange(len(similarities)), block_best]
+                    improved = block_best_similarity > best_similarity
+                    best_index[improved] = block_best[improved] + col_start
+                    best_similarity[improved] = block_best_similarity[improved]
+                    own_rank += (similarities > own[:, None]).sum(axis=1)
+
+                writer.writerows(zip(
+                    range(row_start, row_end), own.tolist(), best_index.tolist(), best_similarity.tolist(), own_rank.tolist()
+                ))
+        print(f"Saved cross similarity results to {output_csv}")
+    except Exception as e:
+        print(f"Error saving results to CSV: {e}")
+    if full_matrix is not None:
+        full_matrix.flush()
+        print(f"Saved the full similarity matrix to {matrix_path}")
+    print(f"Evaluated {nb_rows} x {nb_rows} pairs in {time.perf_counter() - start_time:.2f}s")
+
+def rank_biased_overlap(ranking_a, ranking_b, p=0.9):
+    """
+    Rank-biased overlap of two top-k rankings truncated at depth k and normalized so identical
+    rankings score 1: agreement at the top weighs more than agreement further down the lists.
+    """
+    depth = min(len(ranking_a), len(ranking_b))
+    if depth == 0:
+        return 0.0
+    seen_a, seen_b = set(), set()
+    overlap = 0
+    score = 0.0
+    for d in range(depth):
+        a, b = ranking_a[d], ranking_b[d]
+        if a == b:
+            overlap += 1
+        else:
+            overlap += (a in seen_b) + (b in seen_a)
+        seen_a.add(a)
+        seen_b.add(b)
+        score += p ** d * overlap / (d + 1)
+    return (1 - p) * score / (1 - p ** depth)
+
+
+def _overlap_scores(rankings_a, rankings_b, top_n):
+    overlaps = np.array([len(set(a) & set(b)) / top_n for a, b in zip(rankings_a, rankings_b)])
+    rbos = np.array([rank_biased_overlap(a, b) for a, b in zip(rankings_a, rankings_b)])
+    return overlaps, rbos
 
-def evaluate_top_n_similarity(embeddings, output_csv="results/similarity_scores_top_n.csv", top_n=10):
-    common_scores = []
-    vector_db = vd.MilvusDb()
-
-    for index in range(len(embeddings)):
-        if index >= len(embeddings) or embeddings[index] is None:
-            print(f"Skipping image {index} due to missing or invalid embedding.")
-            continue
-
-        gemini_n_results = vector_db.search_by_embedding(embeddings[index][0], limit=top_n)
-        hf_n_results = vector_db.search_by_embedding(embeddings[index][1], limit=top_n)
-
-        # Ensure results are valid before accessing
-        gemini_md5s = [
-            hit.entity.get("md5")
-            for result in gemini_n_results  # each result is a Hits object
-            for hit    in result            # each hit is a Hit object
-        ]
-        hf_md5 = [
-            hit.entity.get("md5")
-            for result in hf_n_results  # each result is a Hits object
-            for hit    in result            # each hit is a Hit object
-        ]
-
-        common_returns = 0
-        for g_md5 in gemini_md5s:
-            for index in range(len(hf_md5)):
-                if g_md5 == hf_md5[index]:
-                    common_returns += 1
-                    hf_md5.pop(index)  # Prevent duplicate matches
-                    break
-
-        common_scores.append({"common_score": common_returns / top_n})
-
-    if not common_scores:
+
+def evaluate_top_n_similarity(gemini_embeddings, hf_embeddings, output_csv="results/similarity_scores_top_n.csv", top_n=10, exact=True):
+    """
+    Compares the top `top_n` images retrieved with the Gemini caption embedding and with the
+    Hugging Face caption embedding of each image (overlap@k and rank-biased overlap).
+    All the queries of a captioner go to the vector DB as a few batched searches. With `exact`
+    the same comparison is done on an exact local top-k, and the recall of the ANN results against
+    it is reported, which separates index error from captioner disagreement.
+    """
+    if len(gemini_embeddings) == 0 or len(gemini_embeddings) != len(hf_embeddings):
         print("No valid embeddings to evaluate. Skipping CSV generation.")
         return
 
+    import vector_db as vd
+
+    start_time = time.perf_counter()
+    vector_db = vd.get_vector_db()
+    gemini_md5s = [[hit.entity.get("md5") for hit in hits] for hits in vector_db.search_many(gemini_embeddings, limit=top_n)]
+    hf_md5s = [[hit.entity.get("md5") for hit in hits] for hits in vector_db.search_many(hf_embeddings, limit=top_n)]
+    print(f"Searched {2 * len(gemini_md5s)} queries in batches in {time.perf_counter() - start_time:.2f}s")
+
+    columns = {}
+    columns["common_score"], columns["rbo"] = _overlap_scores(gemini_md5s, hf_md5s, top_n)
+    if exact:
+        # Both sets of queries in one call, the collection is streamed once
+        exact_md5s = vector_db.exact_search_md5s(np.vstack([gemini_embeddings, hf_embeddings]), limit=top_n)
+        exact_gemini_md5s, exact_hf_md5s = exact_md5s[:len(gemini_embeddings)], exact_md5s[len(gemini_embeddings):]
+        columns["exact_common_score"], columns["exact_rbo"] = _overlap_scores(exact_gemini_md5s, exact_hf_md5s, top_n)
+        columns["gemini_ann_recall"], _ = _overlap_scores(gemini_md5s, exact_gemini_md5s, top_n)
+        columns["hf_ann_recall"], _ = _overlap_scores(hf_md5s, exact_hf_md5s, top_n)
+
+    for name, values in columns.items():
+        print(f"Mean {name}: {values.mean():.4f}")
+
     try:
         with open(output_csv, "w", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=["common_score"])
-            writer.writeheader()
-            writer.writerows(common_scores)
+            writer = csv.writer(f)
+            writer.writerow(list(columns))
+            writer.writerows(zip(*(values.tolist() for values in columns.values())))
         print(f"Saved top N similarity results to {output_csv}")
     except Exception as e:
         print(f"Error saving results to CSV: {e}")
+    print(f"Evaluated top {top_n} overlap of {len(gemini_md5s)} images in {time.perf_counter() - start_time:.2f}s")
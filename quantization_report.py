@@ -0,0 +1,103 @@
+"""
+Compares compact embedding storage modes against the float32 baseline on our own data.
+
+For every mode the corpus (Gemini caption embeddings) is stored compactly, then searched with
+the Hugging Face caption embeddings as queries. recall@k is the share of the exact float32 top-k
+that the compact corpus still returns, memory is the size of the stored vectors.
+
+Modes:
+- float16: SQLite BLOBs with embedding_dtype='float16' and Milvus FLOAT16_VECTOR
+- int8: per-dimension scalar quantization to 256 levels, what Milvus IVF_SQ8 stores
+- dim768 / dim256: Matryoshka truncation of the vectors (INDEX_DIM), searched alone and with the
+  top 4k candidates re-ranked on the full dimension vectors like vector_db.RerankingVectorDb does
+
+Output saved in results/quantization_report.csv
+"""
+import csv
+import os
+
+import numpy as np
+
+from db import init_db
+from embedding_export import MATRIX_DIR, export_embeddings, load_embedding_matrices
+from local_vector_db import exact_top_k, truncate_embeddings
+
+
+def quantize_int8(matrix):
+    """Per-dimension min/max scalar quantization, returns (codes, minimums, scales)."""
+    minimums = matrix.min(axis=0)
+    scales = (matrix.max(axis=0) - minimums) / 255.0
+    scales[scales == 0] = 1.0
+    codes = np.round((matrix - minimums) / scales).astype(np.uint8)
+    return codes, minimums.astype(np.float32), scales.astype(np.float32)
+
+
+def dequantize_int8(codes, minimums, scales):
+    return codes.astype(np.float32) * scales + minimums
+
+
+def recall_at_k(found_rows, truth_rows):
+    k = truth_rows.shape[1]
+    return float(np.mean([len(set(found) & set(truth)) / k for found, truth in zip(found_rows.tolist(), truth_rows.tolist())]))
+
+
+def rerank(queries, corpus, candidate_rows, k):
+    """Exact full dimension re-ranking of candidate rows, keeps the best k of each query."""
+    reranked = []
+    for query, rows in zip(queries, candidate_rows):
+        candidates = corpus[rows]
+        distances = np.einsum("ij,ij->i", candidates - query, candidates - query)
+        reranked.append(rows[np.argsort(distances, kind="stable")[:k]])
+    return np.array(reranked)
+
+
+def quantization_report(corpus, queries, k=10, output_csv="results/quantization_report.csv", truncated_dims=(768, 256), rerank_factor=4):
+    corpus = np.asarray(corpus, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    k = min(k, len(corpus))
+    _, truth = exact_top_k(queries, corpus, k)
+    baseline_bytes = corpus.nbytes
+
+    rows = [{"mode": "float32", "recall_at_k": 1.0, "bytes": baseline_bytes, "memory_saved": 0.0}]
+
+    corpus_16 = corpus.astype(np.float16)
+    _, found = exact_top_k(queries.astype(np.float16).astype(np.float32), corpus_16.astype(np.float32), k)
+    rows.append({"mode": "float16", "recall_at_k": recall_at_k(found, truth), "bytes": corpus_16.nbytes})
+
+    codes, minimums, scales = quantize_int8(corpus)
+    _, found = exact_top_k(queries, dequantize_int8(codes, minimums, scales), k)
+    rows.append({"mode": "int8", "recall_at_k": recall_at_k(found, truth), "bytes": codes.nbytes + minimums.nbytes + scales.nbytes})
+
+    for dim in truncated_dims:
+        if dim >= corpus.shape[1]:
+            continue
+        corpus_truncated = truncate_embeddings(corpus, dim)
+        queries_truncated = truncate_embeddings(queries, dim)
+        _, found = exact_top_k(queries_truncated, corpus_truncated, k)
+        rows.append({"mode": f"dim{dim}", "recall_at_k": recall_at_k(found, truth), "bytes": corpus_truncated.nbytes})
+        # The full vectors are still stored for re-ranking, but outside of the index memory
+        _, candidates = exact_top_k(queries_truncated, corpus_truncated, k * rerank_factor)
+        found = rerank(queries, corpus, candidates, k)
+        rows.append({"mode": f"dim{dim}+rerank", "recall_at_k": recall_at_k(found, truth), "bytes": corpus_truncated.nbytes})
+
+    for row in rows:
+        row["memory_saved"] = 1.0 - row["bytes"] / baseline_bytes
+        print(f"{row['mode']:>13}: recall@{k}={row['recall_at_k']:.4f}, {row['bytes'] / 1e6:.2f} MB ({row['memory_saved']:.0%} saved)")
+
+    os.makedirs(os.path.dirname(output_csv) or ".", exist_ok=True)
+    with open(output_csv, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["mode", "recall_at_k", "bytes", "memory_saved"])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Saved quantization report to {output_csv}")
+    return rows
+
+
+if __name__ == "__main__":
+    conn = init_db("labels_raghav.db")
+    matrix_dir = os.path.join(MATRIX_DIR, "labels_raghav")
+    export_embeddings(conn, out_dir=matrix_dir)
+    conn.close()
+    _, gemini_matrix, huggingface_matrix = load_embedding_matrices(matrix_dir)
+    print(f"Corpus: {gemini_matrix.shape[0]} Gemini caption embeddings, queries: the matching Hugging Face ones")
+    quantization_report(gemini_matrix, huggingface_matrix, k=10)
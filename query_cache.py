@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_cache import normalize_text
+
+
+def normalize_query(query):
+    """Search queries are matched case-insensitively and ignoring extra whitespace."""
+    return normalize_text(query).lower()
+
+
+class QueryCache:
+    """
+    Exact-match cache of query embeddings for the search path.
+    Entries expire after `ttl_seconds`, the cache is bounded by the bytes of the vectors it holds
+    and can be written to / reloaded from an .npz snapshot so a restart does not start cold.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=24 * 3600, snapshot_path=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_path = snapshot_path
+        # query -> (vector, expires_at, embedding latency in seconds)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        # Searches can save snapshots from several threads at once, they share the temporary file
+        self.snapshot_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+
+        if snapshot_path and os.path.isfile(snapshot_path):
+            self.load_snapshot()
+
+    def _evict(self, query):
+        vector, _, _ = self.entries.pop(query)
+        self.nbytes -= vector.nbytes
+
+    def get(self, query):
+        key = normalize_query(query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] < time.time():
+                self._evict(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.saved_latency += entry[2]
+            return entry[0]
+
+    def put(self, query, vector, latency=0.0, expires_at=None):
+        key = normalize_query(query)
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        if vector.nbytes > self.max_bytes:
+            return
+        if expires_at is None:
+            expires_at = time.time() + self.ttl_seconds
+        with self.lock:
+            if key in self.entries:
+                self._evict(key)
+            self.entries[key] = (vector, expires_at, latency)
+            self.nbytes += vector.nbytes
+            while self.nbytes > self.max_bytes:
+                self._evict(next(iter(self.entries)))
+
+    def save_snapshot(self):
+        """Writes the live entries to `snapshot_path`, replacing the previous snapshot atomically."""
+        if not self.snapshot_path:
+            return
+        now = time.time()
+        with self.lock:
+            live = [(key, entry) for key, entry in self.entries.items() if entry[1] >= now]
+        if not live:
+            return
+        tmp_path = self.snapshot_path + ".tmp.npz"
+        with self.snapshot_lock:
+            np.savez(
+                tmp_path,
+                queries=np.array([key for key, _ in live]),
+                vectors=np.stack([entry[0] for _, entry in live]),
+                expires_at=np.array([entry[1] for _, entry in live], dtype=np.float64),
+                latencies=np.array([entry[2] for _, entry in live], dtype=np.float64),
+            )
+            os.replace(tmp_path, self.snapshot_path)
+        print(f"Saved {len(live)} cached queries to {self.snapshot_path}")
+
+    def load_snapshot(self):
+        try:
+            with np.load(self.snapshot_path) as snapshot:
+                now = time.time()
+                loaded = 0
+                for query, vector, expires_at, latency in zip(
+                    snapshot["queries"], snapshot["vectors"], snapshot["expires_at"], snapshot["latencies"]
+                ):
+                    if expires_at >= now:
+                        self.put(str(query), vector, float(latency), float(expires_at))
+                        loaded += 1
+            print(f"Loaded {loaded} cached queries from {self.snapshot_path}")
+        except Exception as e:
+            print(f"Could not load the query cache snapshot {self.snapshot_path}: {e}")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "saved_latency_seconds": self.saved_latency,
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+            }
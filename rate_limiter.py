@@ -0,0 +1,55 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_minute` tokens per minute."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        self.rate_per_second = rate_per_minute / 60.0
+        # By default allow a burst of up to one minute worth of quota
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate_per_second)
+        self.last_refill = now
+
+    def reserve(self, amount=1):
+        """Takes `amount` tokens from the bucket and returns how long the caller has to wait for them."""
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate_per_second
+
+
+class RateLimiter:
+    """
+    Requests-per-minute / tokens-per-minute limiter meant to be shared by every worker
+    talking to the same API key, so that throughput follows the real quota.
+    """
+
+    def __init__(self, rpm=15, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+
+    def acquire(self, tokens=1):
+        """Blocks until one request using roughly `tokens` tokens is allowed by the quota."""
+        wait = 0.0
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.reserve(tokens))
+        if wait > 0:
+            time.sleep(wait)
+        return wait
@@ -1,17 +1,122 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
+from contextlib import asynccontextmanager
 import os
+import asyncio
+import base64
+import gzip
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+import numpy as np
 
 import gemini_api as ga
 import embeddings as emb
-from db import init_db, label_images, retrieve_images, drop_database, get_description_by_md5
+from db import init_db, label_images_concurrent, embed_images, drop_database
 import vector_db as vd
+from embedding_cache import get_default_cache
+from query_cache import QueryCache, normalize_query
+from catalog import Catalog
+from pipeline_state import stage_counts
+from db_connection import connect_readonly, close_writers
+from jobs import JobQueue
+from rate_limiter import RateLimiter
+from single_flight import SingleFlight
+from lexical_search import lexical_search, reciprocal_rank_fusion
+from thumbnails import ThumbnailCache, THUMBNAIL_SIZES, DEFAULT_SIZE
+
+try:
+    import orjson
+except ImportError:  # the standard json encoder is used instead
+    orjson = None
+
+DEFAULT_PROMPT = "Generate a short, realistic caption like those in the MS-COCO dataset."
+# Ingest jobs run one or two at a time on their own threads, the request threads stay free for searches
+JOB_WORKERS = 2
+LABEL_WORKERS = 4
+# Threads running the blocking vector searches of /search
+SEARCH_WORKERS = 8
+IMAGE_DIR = "data/coco_validation_2017/val2017"
+# Originals can be replaced on disk, thumbnails are named after the image md5 and never change
+IMAGE_CACHE_CONTROL = "public, max-age=86400"
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+SEARCH_RESULT_FIELDS = ("md5", "file_path", "thumbnail_url", "thumbnails", "description", "distance", "score")
+# vector: embedding + ANN search, lexical: BM25 over the captions only, hybrid: both fused with RRF
+SEARCH_MODES = ("vector", "hybrid", "lexical")
+# Past this delay, when the embedding fails or while the quota is exhausted, searches that allow it are
+# answered from the lexical index alone. After a quota error the API is left alone for EMBED_COOLDOWN_SECONDS
+EMBED_TIMEOUT_SECONDS = 2.0
+EMBED_COOLDOWN_SECONDS = 60
+MAX_SEARCH_LIMIT = 100
+# Deepest result a cursor can reach (offset + limit), Milvus caps it at 16384
+MAX_SEARCH_DEPTH = 1000
+# Search responses smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+
+# -------------------- Service state --------------------
+
+def warm_up(app):
+    """
+    Builds the long-lived clients shared by every request, then runs a warm-up search.
+    The service only reports ready once the collection is loaded and the search went through.
+    """
+    try:
+        app.state.query_cache = QueryCache(snapshot_path="query_cache.npz")
+        # Creates / migrates the tables, the requests then read through a read-only connection
+        init_db().close()
+        app.state.conn = connect_readonly("labels.db")
+        app.state.catalog = Catalog.from_db(app.state.conn)
+        app.state.lexical_ready = app.state.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'images_fts'"
+        ).fetchone() is not None
+        app.state.embedder = emb.Embedder()
+        app.state.milvus_db = vd.get_vector_db()  # connects and loads the collection
+        app.state.milvus_db.search_by_embedding(np.zeros(app.state.milvus_db.dim, dtype=np.float32), limit=1)
+        app.state.ready = True
+        print("Service warm-up completed, ready to serve searches.")
+    except Exception as e:
+        app.state.startup_error = str(e)
+        print(f"Service warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.ready = False
+    app.state.startup_error = None
+    app.state.jobs = JobQueue(max_workers=JOB_WORKERS)
+    app.state.search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+    app.state.search_flight = SingleFlight()
+    app.state.embed_flight = SingleFlight()
+    app.state.lexical_ready = False
+    app.state.embed_unavailable_until = 0.0
+    app.state.thumbnails = ThumbnailCache()
+    # Shared by all labeling jobs so together they stay within the Gemini quota
+    app.state.rate_limiter = RateLimiter(rpm=15)
+    # Warm up in the background so the readiness endpoint can answer in the meantime
+    threading.Thread(target=warm_up, args=(app,), daemon=True).start()
+    yield
+    app.state.jobs.shutdown()
+    app.state.search_executor.shutdown(wait=True)
+    app.state.thumbnails.close()
+    query_cache = getattr(app.state, "query_cache", None)
+    if query_cache is not None:
+        query_cache.save_snapshot()
+    conn = getattr(app.state, "conn", None)
+    if conn is not None:
+        conn.close()
+    # Commits what the writer threads still have queued
+    close_writers()
+
+def require_ready():
+    if not app.state.ready:
+        raise HTTPException(status_code=503, detail="Service is warming up.")
 
 # -------------------- FastAPI setup --------------------
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS
 origins = [
@@ -29,6 +134,7 @@ app.add_middleware(
 
 class LabelRequest(BaseModel):
     directory: str  # the folder in which images are stored
+    prompt: Optional[str] = DEFAULT_PROMPT
 
 class EmbedRequest(BaseModel):
     # optionally add fields you need from the front-end, e.g. which images, or an entire text?
@@ -38,8 +144,14 @@ class ResetRequest(BaseModel):
     confirm: str
 
 class SearchRequest(BaseModel):
-    query: str
-    limit: Optional[int] = 10
+    query: Optional[str] = None
+    limit: int = Field(10, ge=1, le=MAX_SEARCH_LIMIT)
+    cursor: Optional[str] = None  # next_cursor of the previous page, replaces the other fields
+    nprobe: Optional[int] = Field(None, ge=vd.SEARCH_PARAM_BOUNDS["nprobe"][0], le=vd.SEARCH_PARAM_BOUNDS["nprobe"][1])
+    ef: Optional[int] = Field(None, ge=vd.SEARCH_PARAM_BOUNDS["ef"][0], le=vd.SEARCH_PARAM_BOUNDS["ef"][1])
+    fields: Optional[List[str]] = None  # subset of SEARCH_RESULT_FIELDS, all of them by default
+    mode: Optional[str] = "vector"  # one of SEARCH_MODES
+    fallback: bool = False  # vector mode: answer from the lexical index when the embedding fails, hybrid always does
 
 # -------------------- Endpoints --------------------
 
@@ -47,58 +159,99 @@ class SearchRequest(BaseModel):
 def read_root():
     return {"message": "Welcome to the FastAPI backend!"}
 
-@app.post("/label-images")
+@app.get("/ready")
+def readiness():
+    """Readiness probe, green once the Milvus collection is loaded and the warm-up search ran."""
+    if app.state.ready:
+        return {"ready": True}
+    return JSONResponse(status_code=503, content={"ready": False, "error": app.state.startup_error})
+
+@app.get("/stats/embedding-cache")
+def embedding_cache_stats():
+    """Hit/miss counters of the embedding cache shared by the embedding call sites."""
+    return get_default_cache().stats()
+
+@app.get("/stats/query-cache")
+def query_cache_stats():
+    """Hit ratio and embedding latency saved by the /search query cache."""
+    require_ready()
+    return app.state.query_cache.stats()
+
+@app.get("/stats/pipeline")
+def pipeline_stats():
+    """Number of images at each ingest stage (hashed, captioned, embedded, indexed) and stuck after repeated failures."""
+    require_ready()
+    return stage_counts(app.state.conn)
+
+def run_label_job(job, directory, prompt):
+    model = ga.ModelApi(rate_limiter=app.state.rate_limiter)
+    conn = init_db()
+    try:
+        label_images_concurrent(directory, model, conn, prompt, workers=LABEL_WORKERS, job=job)
+    finally:
+        conn.close()
+    if app.state.ready:
+        app.state.catalog.refresh(app.state.conn)
+    return f"Labeled {job.processed - job.error_count} images in {directory}."
+
+def run_embed_job(job):
+    conn = init_db()
+    try:
+        # Batched embedding of the captioned images the pipeline state has not indexed yet
+        indexed = embed_images(conn, app.state.embedder, app.state.milvus_db, job=job)
+    finally:
+        conn.close()
+    app.state.catalog.refresh(app.state.conn)
+    return f"Inserted {indexed} embeddings into the vector DB."
+
+@app.post("/label-images", status_code=202)
 def label_images_endpoint(request: LabelRequest):
     """
-    Labels all images in the specified directory that are not yet in the SQLite DB.
+    Queues the labeling of the images in the specified directory that are not yet in the SQLite DB
+    and returns the job at once, its progress is at /jobs/{id}.
     Calls the Gemini model to get a description and saves them to the DB.
     """
+    require_ready()
     directory = request.directory
     if not os.path.isdir(directory):
         raise HTTPException(status_code=400, detail="Directory not found.")
 
-    model = ga.ModelApi()
-    conn = init_db()
-    try:
-        label_images(directory, model, conn)
-    finally:
-        conn.close()
-
-    return {"message": f"Labeling images in {directory} completed."}
+    job = app.state.jobs.submit(
+        "label-images", lambda job: run_label_job(job, directory, request.prompt),
+        params={"directory": directory, "prompt": request.prompt}
+    )
+    return job.to_dict()
 
 
-@app.post("/embed-text")
+@app.post("/embed-text", status_code=202)
 def embed_text_endpoint(request: EmbedRequest):
     """
-    Embeds text for all images that are not currently in Milvus.
+    Queues the embedding of the text of all images that are not currently in Milvus, returns the job at once.
     """
-    try:
-        milvus_db = vd.MilvusDb() 
-        embedder = emb.Embedder()
+    require_ready()
+    job = app.state.jobs.submit("embed-text", run_embed_job)
+    return job.to_dict()
 
-        existing_hashes = milvus_db.get_all_md5_hashes() 
-        conn = init_db()
 
-        images = retrieve_images(conn, existing_hashes)
-        conn.close()
+@app.get("/jobs")
+def list_jobs():
+    return [job.to_dict() for job in app.state.jobs.list()]
 
-        # The "batch_embeddings" method is used for the images' textual descriptions
-        descriptions = [description[:-1] for (_, _, description) in images] 
-        # We embed each description
-        embedding = embedder.batch_embeddings(descriptions)
-
-        # Insert each embedding into Milvus
-        for index in range(len(images)):
-            milvus_db.insert_record(
-                images[index][0],  # md5
-                images[index][1],  # file_path
-                images[index][2],  # description
-                embedding[index][0].values  # the actual embedding vector
-            )
-        
-        return {"message": "Insertion into Milvus done."}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Status of a job: processed / total, rate, ETA and the errors met so far."""
+    job = app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.to_dict()
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """Stops a job after the image or chunk in progress, a queued job never starts."""
+    job = app.state.jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.to_dict()
 
 
 @app.post("/reset-db")
@@ -109,7 +262,7 @@ def reset_db_endpoint(request: ResetRequest):
     """
     if request.confirm.upper() == "YES":
         drop_database()
-        milvus_db = vd.MilvusDb()
+        milvus_db = vd.get_vector_db()
         milvus_db.delete_entire_db()
         return {"message": "All databases have been reset."}
     else:
@@ -118,60 +271,299 @@ def reset_db_endpoint(request: ResetRequest):
 from fastapi.responses import FileResponse
 import os
 
+def etag_matches(request, etag):
+    """True when the If-None-Match header of the request lists `etag` (or is *)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def cached_file_response(request, path, etag, cache_control, media_type=None):
+    """The file with validators, or an empty 304 when the client already has this version."""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
 @app.get("/get-image/{filename}")
-def get_image(filename: str):
-    path = os.path.join("data/coco_validation_2017/val2017", filename)
+def get_image(filename: str, request: Request):
+    path = os.path.join(IMAGE_DIR, os.path.basename(filename))
     if os.path.isfile(path):
-        return FileResponse(path)
+        stat = os.stat(path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        return cached_file_response(request, path, etag, IMAGE_CACHE_CONTROL)
     return {"error": "File not found"}
 
-@app.post("/search")
-def search_endpoint(request: SearchRequest):
+def thumbnail_url(md5, size=DEFAULT_SIZE):
+    return f"http://localhost:8000/thumbnail/{md5}/{size}"
+
+@app.get("/thumbnail/{md5}/{size}")
+async def get_thumbnail(md5: str, size: int, request: Request):
     """
-    Searches the Milvus vector DB given a textual query by generating an embedding
-    of the query and performing a vector similarity search.
+    JPEG thumbnail of an indexed image, its longest side is `size` pixels (one of THUMBNAIL_SIZES).
+    Created on first request in the thumbnail process pool, then served from the disk cache.
+    """
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=404, detail=f"Thumbnail sizes are {list(THUMBNAIL_SIZES)}.")
+    thumbnails = app.state.thumbnails
+    etag = thumbnails.etag(md5, size)
+    # The thumbnail of an md5 never changes, a client holding it needs no lookup at all
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": THUMBNAIL_CACHE_CONTROL})
+
+    path = thumbnails.path(md5, size)
+    if not os.path.isfile(path):
+        require_ready()
+        record = app.state.catalog.lookup([md5])[0]
+        if record is None or not record["image_path"] or not os.path.isfile(record["image_path"]):
+            raise HTTPException(status_code=404, detail="Image not found.")
+        try:
+            path = await asyncio.wrap_future(thumbnails.submit(md5, record["image_path"], size))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Could not create the thumbnail: {e}")
+    return cached_file_response(request, path, etag, THUMBNAIL_CACHE_CONTROL, media_type="image/jpeg")
+
+@app.get("/stats/thumbnails")
+def thumbnail_stats():
+    return app.state.thumbnails.stats()
+
+_lexical_conns = threading.local()
+
+def lexical_conn():
+    """Read-only connection of the current search thread, FTS queries run in parallel on their own connections."""
+    conn = getattr(_lexical_conns, "conn", None)
+    if conn is None:
+        conn = _lexical_conns.conn = connect_readonly("labels.db")
+    return conn
+
+def vector_entries(query_embedding, limit, offset=0, search_params=None, fields=SEARCH_RESULT_FIELDS):
+    """Vector search, blocking: runs on the bounded search executor."""
+    output_fields = ["md5", "file_path"] if "file_path" in fields else ["md5"]
+    results = app.state.milvus_db.search_by_embedding(
+        query_embedding, limit=limit, output_fields=output_fields, offset=offset, search_params=search_params
+    )
+    return [
+        {"md5": hit.entity.get("md5"), "file_path": hit.entity.get("file_path"), "distance": hit.distance}
+        for result in results  # each result is a Hits object
+        for hit in result      # each hit is a Hit object
+    ]
+
+def lexical_entries(query, limit, offset=0):
+    """BM25 search over the captions, blocking: runs on the bounded search executor."""
+    return [
+        {"md5": md5, "file_path": image_path, "description": label, "score": score}
+        for md5, image_path, label, score in lexical_search(lexical_conn(), query, limit, offset)
+    ]
+
+def fuse_entries(vector, lexical, offset, limit):
+    """Reciprocal-rank fusion of the two result lists, `score` is the fused score."""
+    by_md5 = {entry["md5"]: dict(entry, score=None) for entry in lexical}
+    for entry in vector:
+        by_md5[entry["md5"]] = dict(by_md5.get(entry["md5"], {}), **entry)
+    fused = reciprocal_rank_fusion([[entry["md5"] for entry in vector], [entry["md5"] for entry in lexical]])
+    return [dict(by_md5[md5], score=score) for md5, score in fused[offset:offset + limit]]
+
+def format_results(entries, fields=SEARCH_RESULT_FIELDS):
+    """Result objects with only the requested fields, descriptions are hydrated from the catalog."""
+    if "description" in fields and any("description" not in entry for entry in entries):
+        # Hydrate the whole page from the in-memory catalog, picking up images ingested by another process if needed
+        md5s = [entry["md5"] for entry in entries]
+        catalog = app.state.catalog
+        records = catalog.lookup(md5s)
+        if any(record is None for record in records) and catalog.refresh_missing(app.state.conn):
+            records = catalog.lookup(md5s)
+        for entry, record in zip(entries, records):
+            entry.setdefault("description", record["label"] if record else None)
+
+    # Format results for the front-end
+    output = []
+    for entry in entries:
+        md5 = entry["md5"]
+        values = {"md5": md5, "description": entry.get("description"), "distance": entry.get("distance"), "score": entry.get("score")}
+        if "file_path" in fields:
+            values["file_path"] = f"http://localhost:8000/get-image/{os.path.basename(entry.get('file_path') or '')}"
+        if "thumbnail_url" in fields:
+            values["thumbnail_url"] = thumbnail_url(md5)
+        if "thumbnails" in fields:
+            values["thumbnails"] = {str(size): thumbnail_url(md5, size) for size in THUMBNAIL_SIZES}
+        output.append({field: values[field] for field in fields})
+    return output
+
+def encode_cursor(page):
+    return base64.urlsafe_b64encode(json.dumps(page, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    """
+    The page a next_cursor points to:
+    {"q": query, "o": offset, "l": limit, "p": search params, "f": fields, "m": mode, "b": lexical fallback}.
     """
-    # 1. embed the query
-    embedder = emb.Embedder()
-    conn = init_db()
     try:
-        query_embedding_result = embedder.get_embedding(request.query)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        page = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        page = {
+            "q": str(page["q"]), "o": int(page["o"]), "l": int(page["l"]),
+            "p": {name: int(value) for name, value in page.get("p", {}).items() if name in vd.SEARCH_PARAM_BOUNDS},
+            "f": [str(field) for field in page["f"]],
+            "m": str(page.get("m", "vector")),
+            "b": bool(page.get("b", False)),
+        }
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if page["o"] < 0 or not 1 <= page["l"] <= MAX_SEARCH_LIMIT:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return page
+
+def json_response(request, payload):
+    """Compact JSON, with orjson when installed, gzipped for large pages when the client accepts it."""
+    if orjson is not None:
+        body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def embed_query(query):
+    """Query embedding, from the query cache or one async Gemini call shared by identical queries."""
+    query_cache = app.state.query_cache
+    query_embedding = query_cache.get(query)
+    if query_embedding is not None:
+        return query_embedding
 
-    query_embedding = query_embedding_result  # single vector
+    async def embed():
+        start = time.perf_counter()
+        embedding = await app.state.embedder.aget_embedding(query)  # single vector
+        if embedding is not None:
+            query_cache.put(query, embedding, time.perf_counter() - start)
+            # Snapshot now and then so a crash does not lose the whole cache
+            if query_cache.misses % 50 == 0:
+                await asyncio.to_thread(query_cache.save_snapshot)
+        return embedding
 
-    # 2. search in Milvus
+    return await app.state.embed_flight.do(normalize_query(query), embed)
+
+async def embed_for_search(query, fallback):
+    """
+    Query embedding for /search. With a lexical `fallback` it gives up (returns None) after EMBED_TIMEOUT_SECONDS
+    or when the request fails, and once the quota is exhausted it skips the API for EMBED_COOLDOWN_SECONDS.
+    """
+    if not fallback:
+        try:
+            embedding = await embed_query(query)
+        except emb.QuotaExceeded as e:
+            raise HTTPException(status_code=429, detail=f"Embedding quota exhausted: {e}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if embedding is None:
+            raise HTTPException(status_code=502, detail="Could not embed the query.")
+        return embedding
+    if time.time() < app.state.embed_unavailable_until:
+        # Only the queries already in the query cache get a vector until the cool-down is over
+        return app.state.query_cache.get(query)
     try:
-        milvus_db = vd.MilvusDb()
-        results = milvus_db.search_by_embedding(query_embedding, limit=request.limit)
-        # Format results for the front-end
-        output = []
-        md5s = [
-            hit.entity.get("md5")
-            for result in results  # each result is a Hits object
-            for hit    in result            # each hit is a Hit object
-        ]
-        file_paths =  [
-            hit.entity.get("file_path")
-            for result in results  # each result is a Hits object
-            for hit    in result            # each hit is a Hit object
-        ]
-        distances =  [
-            hit.distance
-            for result in results  # each result is a Hits object
-            for hit    in result            # each hit is a Hit object
-        ]
-        descriptions = [get_description_by_md5(conn, md5) for md5 in md5s]
-
-        for index in range(len(md5s)):
-            output.append({
-                "md5": md5s[index],
-                "file_path": f"http://localhost:8000/get-image/{os.path.basename(file_paths[index])}",
-                "description": descriptions[index],
-                "distance": distances[index]
-            })
-            print(f"Result {index}: {output[index]}")
-        return {"results": output}
+        # Only this request stops waiting, the shared embedding still lands in the query cache
+        embedding = await asyncio.wait_for(embed_query(query), EMBED_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"Embedding took over {EMBED_TIMEOUT_SECONDS}s, answering '{query}' from the lexical index.")
+        return None
+    except emb.QuotaExceeded as e:
+        print(f"Embedding quota exhausted ({e}), answering from the lexical index for {EMBED_COOLDOWN_SECONDS}s.")
+        app.state.embed_unavailable_until = time.time() + EMBED_COOLDOWN_SECONDS
+        return None
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        print(f"Embedding failed ({e}), answering '{query}' from the lexical index.")
+        return None
+    if embedding is None:
+        print(f"Embedding failed, answering '{query}' from the lexical index.")
+    return embedding
+
+@app.post("/search")
+async def search_endpoint(request: SearchRequest, http_request: Request):
+    """
+    Searches the Milvus vector DB given a textual query by generating an embedding
+    of the query and performing a vector similarity search.
+    Identical queries in flight at the same time share one embedding call and one search.
+    The response has a `next_cursor` while there are more results, sending it back as `cursor` returns the
+    next page from the cached query vector and Milvus' offset, with the same limit, search params and fields.
+    `mode` "lexical" searches the captions' full-text index only, "hybrid" runs both searches in parallel and
+    fuses them with reciprocal-rank fusion. When the embedding API is slow or failing, hybrid searches (and
+    vector searches sent with `fallback`) are answered from the full-text index, the response's `mode` tells
+    which search was used and the next pages stay on it.
+    """
+    require_ready()
+    if request.cursor:
+        page = decode_cursor(request.cursor)
+    elif request.query:
+        params = {"nprobe": request.nprobe, "ef": request.ef}
+        page = {
+            "q": request.query, "o": 0, "l": request.limit,
+            "p": {name: value for name, value in params.items() if value is not None},
+            "f": list(request.fields or SEARCH_RESULT_FIELDS),
+            "m": request.mode or "vector",
+            "b": request.fallback,
+        }
+    else:
+        raise HTTPException(status_code=400, detail="A query or a cursor is required.")
+    unknown = [field for field in page["f"] if field not in SEARCH_RESULT_FIELDS]
+    if unknown or not page["f"]:
+        raise HTTPException(status_code=400, detail=f"Fields must be among {list(SEARCH_RESULT_FIELDS)}.")
+    if page["m"] not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"Mode must be one of {list(SEARCH_MODES)}.")
+    if page["m"] != "vector" and not app.state.lexical_ready:
+        raise HTTPException(status_code=503, detail="The full-text index is not available.")
+    query, offset, limit, mode = page["q"], page["o"], page["l"], page["m"]
+    if offset + limit > MAX_SEARCH_DEPTH:
+        raise HTTPException(status_code=400, detail=f"Results are paginated up to the first {MAX_SEARCH_DEPTH}.")
+
+    async def search():
+        loop = asyncio.get_running_loop()
+        executor = app.state.search_executor
+        used = mode
+        try:
+            if mode == "lexical":
+                entries = await loop.run_in_executor(executor, lexical_entries, query, limit, offset)
+            else:
+                # The full-text search starts right away, in parallel with the embedding and the vector search
+                lexical = None
+                if mode == "hybrid":
+                    lexical = loop.run_in_executor(executor, lexical_entries, query, offset + limit, 0)
+                # 1. embed the query, repeated queries and next pages are answered from the query cache
+                fallback = app.state.lexical_ready and (mode == "hybrid" or page["b"])
+                query_embedding = await embed_for_search(query, fallback=fallback)
+                if query_embedding is None:
+                    used = "lexical"
+                    if lexical is None:
+                        entries = await loop.run_in_executor(executor, lexical_entries, query, limit, offset)
+                    else:
+                        entries = (await lexical)[offset:offset + limit]
+                # 2. search in Milvus, pymilvus has no asyncio API for collections so it runs on a bounded executor
+                elif mode == "vector":
+                    entries = await loop.run_in_executor(
+                        executor, vector_entries, query_embedding, limit, offset, page["p"], page["f"]
+                    )
+                else:
+                    vector = await loop.run_in_executor(
+                        executor, vector_entries, query_embedding, offset + limit, 0, page["p"], page["f"]
+                    )
+                    entries = fuse_entries(vector, await lexical, offset, limit)
+            results = await loop.run_in_executor(executor, format_results, entries, page["f"])
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        more = len(results) == limit and offset + 2 * limit <= MAX_SEARCH_DEPTH
+        # The next pages continue with the search that answered this one, a lexical fallback stays lexical
+        next_cursor = encode_cursor(dict(page, o=offset + limit, m=used)) if more else None
+        return {"results": results, "mode": used, "next_cursor": next_cursor}
+
+    key = (normalize_query(query), offset, limit, tuple(sorted(page["p"].items())), tuple(page["f"]), mode, page["b"])
+    payload = await app.state.search_flight.do(key, search)
+    return json_response(http_request, payload)
+
+@app.get("/stats/single-flight")
+def single_flight_stats():
+    """How many searches and query embeddings were shared by identical concurrent requests."""
+    require_ready()
+    return {"search": app.state.search_flight.stats(), "embedding": app.state.embed_flight.stats()}
@@ -0,0 +1,28 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key is in flight, later callers
+    await the same task instead of starting their own. The task is shielded, a caller that
+    goes away (client disconnect) does not cancel the work the others are waiting for.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.started = 0
+        self.shared = 0
+
+    async def do(self, key, make_coroutine):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make_coroutine())
+            self.calls[key] = task
+            self.started += 1
+            task.add_done_callback(lambda _: self.calls.pop(key, None) if self.calls.get(key) is task else None)
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"in_flight": len(self.calls), "started": self.started, "shared": self.shared}
@@ -0,0 +1,133 @@
+"""
+Thumbnails of the indexed images, in a few fixed sizes, cached on disk by md5 and size.
+
+Decoding and resizing a COCO JPEG is CPU bound, so it runs in a process pool: the server
+creates thumbnails lazily on first request, `python main.py --thumbnails` creates them ahead of time.
+Files are named after the md5 of the source image, so their content never changes and they
+can be served with a strong ETag and a long Cache-Control.
+"""
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# Longest side in pixels, the search page uses the 320 one
+THUMBNAIL_SIZES = (160, 320, 640)
+DEFAULT_SIZE = 320
+THUMBNAIL_DIR = "data/thumbnails"
+JPEG_QUALITY = 85
+
+
+def make_thumbnail(source_path, target_path, size, quality=JPEG_QUALITY):
+    """Writes a JPEG of `source_path` fitting in size x size. Runs in the worker processes."""
+    from PIL import Image
+
+    with Image.open(source_path) as image:
+        # Lets the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding, much cheaper than a full decode
+        image.draft("RGB", (size, size))
+        image = image.convert("RGB")
+        image.thumbnail((size, size), Image.LANCZOS)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        # Written next to the target then renamed, readers never see a partial file
+        temp_path = f"{target_path}.{os.getpid()}.tmp"
+        image.save(temp_path, "JPEG", quality=quality, optimize=True)
+    os.replace(temp_path, target_path)
+    return target_path
+
+
+class ThumbnailCache:
+    """
+    On-disk thumbnail cache: <cache_dir>/<size>/<md5[:2]>/<md5>.jpg.
+    Concurrent requests for the same missing thumbnail wait for one resize.
+    """
+
+    def __init__(self, cache_dir=THUMBNAIL_DIR, sizes=THUMBNAIL_SIZES, workers=None):
+        self.cache_dir = cache_dir
+        self.sizes = tuple(sizes)
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.executor = None
+        self.in_flight = {}
+        self.generated = 0
+        # Reentrant: a future that is already done runs its callback inside add_done_callback
+        self.lock = threading.RLock()
+
+    def path(self, md5, size):
+        return os.path.join(self.cache_dir, str(size), md5[:2], f"{md5}.jpg")
+
+    def etag(self, md5, size):
+        return f'"{md5}-{size}"'
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self.executor
+
+    def submit(self, md5, source_path, size):
+        """
+        Future of the thumbnail path, already resolved when the file is cached.
+        Raises ValueError for a size that is not in `sizes`.
+        """
+        if size not in self.sizes:
+            raise ValueError(f"Thumbnail size {size} is not one of {self.sizes}")
+        target_path = self.path(md5, size)
+        key = (md5, size)
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                return future
+        if os.path.isfile(target_path):
+            future = Future()
+            future.set_result(target_path)
+            return future
+
+        executor = self._executor()
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is None:
+                future = executor.submit(make_thumbnail, source_path, target_path, size)
+                self.in_flight[key] = future
+                future.add_done_callback(lambda done: self._done(key, done))
+        return future
+
+    def _done(self, key, future):
+        with self.lock:
+            self.in_flight.pop(key, None)
+            if not future.cancelled() and future.exception() is None:
+                self.generated += 1
+
+    def get(self, md5, source_path, size=DEFAULT_SIZE):
+        """Path of the thumbnail, created first if needed."""
+        return self.submit(md5, source_path, size).result()
+
+    def generate_many(self, images, sizes=None):
+        """
+        Creates the missing thumbnails of (md5, source_path) pairs in every size.
+        Returns (created, failed) counts.
+        """
+        futures = []
+        for md5, source_path in images:
+            for size in sizes or self.sizes:
+                if not os.path.isfile(self.path(md5, size)) and os.path.isfile(source_path):
+                    futures.append(self.submit(md5, source_path, size))
+        created = failed = 0
+        for index, future in enumerate(futures, 1):
+            try:
+                future.result()
+                created += 1
+            except Exception as e:
+                failed += 1
+                print(f"Could not create a thumbnail: {e}")
+            if index % 1000 == 0:
+                print(f"Created {index}/{len(futures)} thumbnails")
+        return created, failed
+
+    def stats(self):
+        with self.lock:
+            return {"sizes": list(self.sizes), "workers": self.workers, "in_flight": len(self.in_flight), "generated": self.generated}
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
@@ -1,56 +1,333 @@
-from pymilvus import (
-    connections,
-    utility,
-    FieldSchema,
-    CollectionSchema,
-    DataType,
-    Collection
-)
 import numpy as np
+import os
+import json
+import time
+from dotenv import dotenv_values
+
+INDEX_SETTINGS_PATH = "index_settings.json"
+
+# Default search parameter of each index type, used until the auto-tuner picked a value
+DEFAULT_SEARCH_PARAMS = {
+    "FLAT": {},
+    "IVF_FLAT": {"nprobe": 10},
+    "IVF_SQ8": {"nprobe": 10},
+    "HNSW": {"ef": 64},
+}
+# Range a search request may set nprobe / ef to, HNSW also needs ef >= offset + limit
+SEARCH_PARAM_BOUNDS = {"nprobe": (1, 256), "ef": (8, 1024)}
+SEARCH_OUTPUT_FIELDS = ("md5", "file_path", "description")
+
+
+def resolve_search_params(defaults, overrides=None, top_k=10, nlist=None):
+    """
+    The index's search params with the `overrides` of a request applied. Only the parameters the
+    index type uses are taken, clamped to SEARCH_PARAM_BOUNDS (and nprobe to nlist).
+    """
+    params = dict(defaults)
+    for name, value in (overrides or {}).items():
+        if name in params and value is not None:
+            low, high = SEARCH_PARAM_BOUNDS[name]
+            params[name] = min(max(int(value), low), high)
+    if "nprobe" in params and nlist:
+        params["nprobe"] = min(params["nprobe"], nlist)
+    if "ef" in params:
+        params["ef"] = max(params["ef"], top_k)
+    return params
+
+
+def choose_index(num_entities, target="balanced"):
+    """
+    Picks the index type and build parameters from the collection size and the configured target:
+    "recall" favours exact / graph indexes, "latency" favours the compact IVF_SQ8, "balanced" sits in between.
+    """
+    if num_entities < 10000:
+        # Clustering a small collection only costs recall, brute force is already fast
+        return "FLAT", {}
+    nlist = int(min(65536, max(16, 4 * np.sqrt(num_entities))))
+    if target == "recall" or num_entities >= 1000000:
+        return "HNSW", {"M": 16, "efConstruction": 200}
+    if target == "latency":
+        return "IVF_SQ8", {"nlist": nlist}
+    return "IVF_FLAT", {"nlist": nlist}
+
+
+# The index is rebuilt once the collection holds this many times the vectors it was built for
+REINDEX_GROWTH = 4
+
+
+def index_outgrown(settings, num_entities, target="balanced"):
+    """True when choose_index() now picks another index type, or an IVF / HNSW index is REINDEX_GROWTH times too small."""
+    if choose_index(num_entities, target)[0] != settings["index_type"]:
+        return True
+    built_for = settings.get("num_entities")
+    return settings["index_type"] != "FLAT" and built_for is not None and num_entities >= REINDEX_GROWTH * max(built_for, 1)
+
+
+def load_index_settings(collection_name, path=INDEX_SETTINGS_PATH):
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f).get(collection_name)
+
+
+def save_index_settings(collection_name, settings, path=INDEX_SETTINGS_PATH):
+    all_settings = {}
+    if os.path.isfile(path):
+        with open(path, "r") as f:
+            all_settings = json.load(f)
+    all_settings[collection_name] = settings
+    with open(path, "w") as f:
+        json.dump(all_settings, f, indent=2)
+
 
 class MilvusDb:
-    def __init__(self, collection_name="image_embeddings", dim=3072):
+    def __init__(self, collection_name="image_embeddings", dim=3072, vector_dtype=None):
+        """
+        vector_dtype is "float32" (FLOAT_VECTOR) or "float16" (FLOAT16_VECTOR, half the memory),
+        it defaults to VECTOR_DTYPE in .env and only applies when the collection is created.
+        """
+        # pymilvus is slow to import, only load it when a Milvus collection is actually used
+        from pymilvus import connections, utility, FieldSchema, CollectionSchema, DataType, Collection
+
         connections.connect(uri="http://localhost:19530", token="root:Milvus")
         self.collection_name = collection_name
         self.dim = dim
 
         if utility.has_collection(collection_name):
             self.collection = Collection(collection_name)
+            embedding_field = next(field for field in self.collection.schema.fields if field.name == "embedding")
+            self.vector_dtype = "float16" if embedding_field.dtype == DataType.FLOAT16_VECTOR else "float32"
+            stored_dim = int(embedding_field.params.get("dim", dim))
+            if stored_dim != dim:
+                raise ValueError(f"Collection '{collection_name}' holds {stored_dim}-d vectors, expected {dim}")
             print(f"Connected to existing Milvus collection '{collection_name}'.")
         else:
+            self.vector_dtype = vector_dtype or dotenv_values(".env").get("VECTOR_DTYPE", "float32")
+            vector_type = DataType.FLOAT16_VECTOR if self.vector_dtype == "float16" else DataType.FLOAT_VECTOR
             fields = [
                 FieldSchema(name="md5", dtype=DataType.VARCHAR, max_length=32, is_primary=True, auto_id=False),
                 FieldSchema(name="file_path", dtype=DataType.VARCHAR, max_length=256),
                 FieldSchema(name="description", dtype=DataType.VARCHAR, max_length=512),
-                FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=3072)
+                FieldSchema(name="embedding", dtype=vector_type, dim=dim)
             ]
-            schema = CollectionSchema(fields, description="Image embeddings with metadata")
+            # The dimension of the indexed vectors is recorded in the collection metadata
+            schema = CollectionSchema(fields, description=f"Image embeddings with metadata (dim={dim})")
             self.collection = Collection(collection_name, schema)
             print(f"Created new Milvus collection '{collection_name}'.")
 
         self.create_index()
 
-    def create_index(self):
+    def create_index(self, rebuild=False):
+        """
+        Builds the index chosen by choose_index() for the current collection size, or reuses the
+        existing one. Replacing an index releases the collection and stops the searches until the new
+        one is loaded, so an index that no longer fits (see index_outgrown, e.g. the FLAT index of an
+        empty collection once it holds 10000 vectors) is only reported, `rebuild` (main.py --tune-index)
+        replaces it. INDEX_TARGET (recall, latency or balanced) in .env sets the trade-off.
+        """
+        settings = load_index_settings(self.collection_name)
+        target = dotenv_values(".env").get("INDEX_TARGET", "balanced")
+        num_entities = self.collection.num_entities
+        if self.collection.has_index() and not rebuild:
+            if settings is None:
+                index_type = self.collection.index().params.get("index_type", "IVF_FLAT")
+                settings = {"index_type": index_type, "search_params": DEFAULT_SEARCH_PARAMS.get(index_type, {})}
+            if index_outgrown(settings, num_entities, target):
+                print(f"The {settings['index_type']} index no longer fits {num_entities} vectors, "
+                      f"run main.py --tune-index to rebuild it.")
+            # Index already built by a previous run, only make sure the collection is loaded
+            self.search_params = settings["search_params"]
+            self.nlist = settings.get("index_params", {}).get("nlist")
+            self.collection.load()
+            return settings
+
+        index_type, params = choose_index(num_entities, target)
+        if self.collection.has_index():
+            self.collection.release()
+            self.collection.drop_index()
         self.collection.create_index(
             field_name="embedding",
             index_params={
                 "metric_type": "L2",
-                "index_type": "IVF_FLAT",
-                "params": {"nlist": 1024}
+                "index_type": index_type,
+                "params": params
             }
         )
         self.collection.load()
 
+        settings = {
+            "index_type": index_type,
+            "index_params": params,
+            "search_params": DEFAULT_SEARCH_PARAMS[index_type],
+            "num_entities": num_entities,
+            "target": target,
+        }
+        save_index_settings(self.collection_name, settings)
+        self.search_params = settings["search_params"]
+        self.nlist = params.get("nlist")
+        print(f"Built {index_type} index {params} for {num_entities} vectors (target: {target}).")
+        return settings
+
+    def _vectors_for_client(self, vectors):
+        """Converts an (N, dim) matrix into the rows the client expects for the embedding field."""
+        vectors = np.asarray(vectors)
+        if self.vector_dtype == "float16":
+            return list(vectors.astype(np.float16))
+        return list(vectors.astype(np.float32, copy=False))
+
+    def _vector_from_client(self, value):
+        if isinstance(value, (bytes, bytearray)):
+            return np.frombuffer(value, dtype=np.float16 if self.vector_dtype == "float16" else np.float32)
+        if isinstance(value, list) and value and isinstance(value[0], (bytes, bytearray)):
+            return np.frombuffer(value[0], dtype=np.float16)
+        return np.asarray(value, dtype=np.float32)
+
+    def _iter_vectors(self, batch_size=1000):
+        """Yields the md5s and vectors of the collection, `batch_size` records at a time."""
+        iterator = self.collection.query_iterator(batch_size=batch_size, expr="md5 != ''", output_fields=["md5", "embedding"])
+        while True:
+            batch = iterator.next()
+            if not batch:
+                iterator.close()
+                break
+            vectors = np.array([self._vector_from_client(record["embedding"]) for record in batch], dtype=np.float32)
+            yield [record["md5"] for record in batch], vectors.reshape(-1, self.dim)
+
+    def _all_md5s(self, batch_size=10000):
+        md5s = []
+        iterator = self.collection.query_iterator(batch_size=batch_size, expr="md5 != ''", output_fields=["md5"])
+        while True:
+            batch = iterator.next()
+            if not batch:
+                iterator.close()
+                break
+            md5s.extend(record["md5"] for record in batch)
+        return md5s
+
+    def _vectors_of(self, md5s):
+        """Vectors of the given md5s, in the same order."""
+        records = self.collection.query(expr=f"md5 in {json.dumps(list(md5s))}", output_fields=["md5", "embedding"])
+        by_md5 = {record["md5"]: self._vector_from_client(record["embedding"]) for record in records}
+        return np.array([by_md5[md5] for md5 in md5s], dtype=np.float32).reshape(-1, self.dim)
+
+    def _streamed_exact_top_k(self, queries, k, batch_size=1000):
+        """
+        Exact top-k md5s of every query over the whole collection, read `batch_size` vectors at a time:
+        only the queries, one batch and the running top-k are in memory.
+        """
+        from local_vector_db import exact_top_k
+
+        best_distances = np.empty((len(queries), 0), dtype=np.float32)
+        best_md5s = np.empty((len(queries), 0), dtype=object)
+        for md5s, vectors in self._iter_vectors(batch_size):
+            distances, rows = exact_top_k(queries, vectors, k)
+            distances = np.concatenate([best_distances, distances], axis=1)
+            candidates = np.concatenate([best_md5s, np.array(md5s, dtype=object)[rows]], axis=1)
+            order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+            best_distances = np.take_along_axis(distances, order, axis=1)
+            best_md5s = np.take_along_axis(candidates, order, axis=1)
+        return best_md5s.tolist()
+
+    def tune_search_params(self, sample_size=200, k=10, target_recall=0.95):
+        """
+        Measures recall@k of the ANN index against exact search on sampled queries and keeps the
+        smallest nprobe / ef reaching `target_recall`. Each sampled vector is used as a held-out query:
+        its own record is dropped from both result lists. The choice is persisted and logged.
+        Only the md5s and the `sample_size` query vectors are loaded, the exact top-k streams the
+        collection batch by batch, so memory does not grow with the collection.
+        """
+        settings = self.create_index()
+        index_type = settings["index_type"]
+        if index_type == "FLAT":
+            print("FLAT index is exact, nothing to tune.")
+            return settings
+
+        md5s = self._all_md5s()
+        if len(md5s) <= k:
+            print("Not enough vectors to tune the search parameters.")
+            return settings
+        rng = np.random.default_rng(0)
+        sample = [md5s[row] for row in rng.choice(len(md5s), size=min(sample_size, len(md5s)), replace=False).tolist()]
+        del md5s
+        queries = self._vectors_of(sample)
+        truth = [
+            set(exact) - {query_md5}
+            for query_md5, exact in zip(sample, self._streamed_exact_top_k(queries, k + 1))
+        ]
+
+        if index_type == "HNSW":
+            name, candidates = "ef", [value for value in (16, 32, 64, 128, 256, 512) if value >= k + 1]
+        else:
+            nlist = settings.get("index_params", {}).get("nlist") or self.collection.index().params.get("params", {}).get("nlist", 1024)
+            name, candidates = "nprobe", [value for value in (1, 2, 4, 8, 16, 32, 64, 128, 256, 512) if value <= nlist]
+
+        chosen = None
+        for value in candidates:
+            start = time.perf_counter()
+            results = self.collection.search(
+                data=self._vectors_for_client(queries),
+                anns_field="embedding",
+                param={"metric_type": "L2", "params": {name: value}},
+                limit=k + 1,
+                output_fields=["md5"]
+            )
+            latency = (time.perf_counter() - start) / len(queries)
+            found = [
+                {hit.entity.get("md5") for hit in hits} - {query_md5}
+                for query_md5, hits in zip(sample, results)
+            ]
+            recall = float(np.mean([len(f & t) / len(t) for f, t in zip(found, truth) if t]))
+            print(f"{name}={value}: recall@{k}={recall:.3f}, {latency * 1000:.2f} ms/query")
+            chosen = {name: value}
+            if recall >= target_recall:
+                break
+
+        settings["search_params"] = chosen
+        settings["tuned"] = {"k": k, "target_recall": target_recall, "recall": recall, "latency_ms": latency * 1000}
+        save_index_settings(self.collection_name, settings)
+        self.search_params = chosen
+        print(f"Using {index_type} search params {chosen} (recall@{k}={recall:.3f}).")
+        return settings
+
     def insert_record(self, md5, file_path, description, embedding):
         if not isinstance(embedding, (list, np.ndarray)) or len(embedding) != self.dim:
             print(f"Invalid embedding for {file_path}. Skipping insertion.")
             return
-        if isinstance(embedding, np.ndarray):
+        if self.vector_dtype == "float16":
+            embedding = np.asarray(embedding, dtype=np.float16)
+        elif isinstance(embedding, np.ndarray):
             embedding = embedding.tolist()  # Convert NumPy array to list
         data = [[md5], [file_path], [description], [embedding]]
         result = self.collection.insert(data)
         return result
 
+    def insert_many(self, md5s, file_paths, descriptions, embeddings, max_batch_bytes=32 * 1024 * 1024):
+        """
+        Inserts many records at once in column based batches of at most `max_batch_bytes` of vectors.
+        `embeddings` is an (N, dim) matrix, it is validated once and handed to the client as NumPy rows,
+        the collection is flushed once at the end.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected an (N, {self.dim}) embedding matrix, got {embeddings.shape}")
+        nb_records = embeddings.shape[0]
+        if not (len(md5s) == len(file_paths) == len(descriptions) == nb_records):
+            raise ValueError("md5s, file_paths, descriptions and embeddings must have the same length")
+        if nb_records == 0:
+            return 0
+
+        md5s, file_paths, descriptions = list(md5s), list(file_paths), list(descriptions)
+        rows_per_batch = max(1, max_batch_bytes // embeddings[0].nbytes)
+        inserted = 0
+        for start in range(0, nb_records, rows_per_batch):
+            end = min(start + rows_per_batch, nb_records)
+            data = [md5s[start:end], file_paths[start:end], descriptions[start:end], self._vectors_for_client(embeddings[start:end])]
+            result = self.collection.insert(data)
+            inserted += result.insert_count
+            print(f"Inserted {end} out of {nb_records} records into Milvus")
+        self.collection.flush()
+        return inserted
+
     def delete_record(self, md5):
         expr = f"md5 == '{md5}'"
         self.collection.delete(expr)
@@ -75,6 +352,8 @@ class MilvusDb:
         record = query_results[0]
         file_path = record["file_path"]
         embedding = record["embedding"]
+        if self.vector_dtype == "float16":
+            embedding = self._vector_from_client(embedding).astype(np.float16)
 
         data = [
             {
@@ -90,18 +369,55 @@ class MilvusDb:
         print(f"Updated description for md5 '{md5}'.")
         return res
 
-    def search_by_embedding(self, query_embedding, limit=10):
-        search_params = {"metric_type": "L2", "params": {"nprobe": 10}}
+    def search_by_embedding(self, query_embedding, limit=10, output_fields=SEARCH_OUTPUT_FIELDS, offset=0, search_params=None):
+        """
+        Top `limit` hits after skipping the first `offset` ones. `search_params` ({"nprobe": ..} or {"ef": ..})
+        overrides the tuned values within SEARCH_PARAM_BOUNDS.
+        """
+        param = {
+            "metric_type": "L2",
+            "params": resolve_search_params(self.search_params, search_params, offset + limit, self.nlist),
+            "offset": offset,
+        }
         results = self.collection.search(
-            data=[query_embedding],
+            data=self._vectors_for_client([query_embedding]),
             anns_field="embedding",
-            param=search_params,
+            param=param,
             limit=limit,
             expr=None,
-            output_fields=["md5", "file_path", "description"]
+            output_fields=list(output_fields)
         )
         return results
 
+    def search_many(self, query_embeddings, limit=10, output_fields=("md5",), batch_size=1000, search_params=None):
+        """
+        Searches many query vectors with one collection.search call per `batch_size` queries.
+        Returns one list of hits per query, in the order of `query_embeddings`.
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        search_params = {"metric_type": "L2", "params": resolve_search_params(self.search_params, search_params, limit, self.nlist)}
+        results = []
+        for start in range(0, len(query_embeddings), batch_size):
+            batch = query_embeddings[start:start + batch_size]
+            results.extend(self.collection.search(
+                data=self._vectors_for_client(batch),
+                anns_field="embedding",
+                param=search_params,
+                limit=limit,
+                expr=None,
+                output_fields=list(output_fields)
+            ))
+        return results
+
+    def exact_search_md5s(self, query_embeddings, limit=10, batch_size=1000):
+        """
+        Exact top-`limit` md5s of every query, computed locally while the stored vectors stream by
+        `batch_size` at a time (see _streamed_exact_top_k). Pass all the queries in one call, the
+        collection is read once per call.
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        return self._streamed_exact_top_k(queries, limit, batch_size)
+
     def get_by_md5(self, md5: str):
         """
         Retrieve a single record matching the given md5.
@@ -116,8 +432,161 @@ class MilvusDb:
             return None
         return results[0]
 
+    def count(self):
+        """Number of records in the collection, deleted ones are only subtracted after compaction."""
+        return self.collection.num_entities
+
     def get_all_md5_hashes(self):
         expr = "md5 != ''"  # any valid filtering on your text field
         query_results = self.collection.query(expr=expr, output_fields=["md5"])
         md5_hashes = list({record["md5"] for record in query_results if "md5" in record})
         return md5_hashes
+
+
+class RerankingVectorDb:
+    """
+    Two-stage search: the ANN index holds truncated `index_dim` vectors (see truncate_embeddings),
+    the full dimension vectors live in a memory-mapped LocalVectorDb and re-rank the top
+    `limit * rerank_factor` candidates exactly. Callers keep passing full dimension vectors.
+    """
+
+    def __init__(self, index_db, full_db, rerank_factor=4):
+        self.index_db = index_db
+        self.full_db = full_db
+        self.dim = full_db.dim
+        self.index_dim = index_db.dim
+        self.rerank_factor = rerank_factor
+
+    def create_index(self, rebuild=False):
+        return self.index_db.create_index(rebuild=rebuild)
+
+    def tune_search_params(self, sample_size=200, k=10, target_recall=0.95):
+        """Tunes the ANN stage, on the truncated vectors it holds."""
+        return self.index_db.tune_search_params(sample_size=sample_size, k=k, target_recall=target_recall)
+
+    def insert_record(self, md5, file_path, description, embedding):
+        if not isinstance(embedding, (list, np.ndarray)) or len(embedding) != self.dim:
+            print(f"Invalid embedding for {file_path}. Skipping insertion.")
+            return
+        return self.insert_many([md5], [file_path], [description], np.asarray(embedding, dtype=np.float32)[None, :])
+
+    def insert_many(self, md5s, file_paths, descriptions, embeddings, max_batch_bytes=32 * 1024 * 1024):
+        from local_vector_db import truncate_embeddings
+
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected an (N, {self.dim}) embedding matrix, got {embeddings.shape}")
+        self.full_db.insert_many(md5s, file_paths, descriptions, embeddings)
+        return self.index_db.insert_many(md5s, file_paths, descriptions, truncate_embeddings(embeddings, self.index_dim), max_batch_bytes)
+
+    def delete_record(self, md5):
+        self.index_db.delete_record(md5)
+        self.full_db.delete_record(md5)
+
+    def update_description(self, md5: str, new_description: str):
+        self.full_db.update_description(md5, new_description)
+        return self.index_db.update_description(md5, new_description)
+
+    def search_many(self, query_embeddings, limit=10, output_fields=("md5",), batch_size=1000, search_params=None, offset=0):
+        """
+        ANN search on the truncated vectors, then exact re-ranking of the candidates on the full ones.
+        With an `offset` the first `offset` re-ranked hits are skipped.
+        """
+        from local_vector_db import LocalHit, truncate_embeddings
+
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        candidates = self.index_db.search_many(
+            truncate_embeddings(queries, self.index_dim), limit=(offset + limit) * self.rerank_factor,
+            output_fields=tuple(dict.fromkeys(("md5",) + tuple(output_fields))), batch_size=batch_size,
+            search_params=search_params
+        )
+        results = []
+        for query, hits in zip(queries, candidates):
+            hits = list(hits)
+            vectors, found = self.full_db.get_vectors([hit.entity.get("md5") for hit in hits])
+            distances = np.einsum("ij,ij->i", vectors - query, vectors - query)
+            distances[~found] = np.inf
+            order = [i for i in np.argsort(distances, kind="stable").tolist() if found[i]][offset:offset + limit]
+            results.append([
+                LocalHit(hits[i].entity.get("md5"), float(distances[i]), {field: hits[i].entity.get(field) for field in output_fields})
+                for i in order
+            ])
+        return results
+
+    def search_by_embedding(self, query_embedding, limit=10, output_fields=SEARCH_OUTPUT_FIELDS, offset=0, search_params=None):
+        return self.search_many([query_embedding], limit=limit, output_fields=output_fields, offset=offset, search_params=search_params)
+
+    def exact_search_md5s(self, query_embeddings, limit=10):
+        return self.full_db.exact_search_md5s(query_embeddings, limit)
+
+    def get_by_md5(self, md5: str):
+        return self.full_db.get_by_md5(md5)
+
+    def count(self):
+        return self.index_db.count()
+
+    def get_all_md5_hashes(self):
+        return self.index_db.get_all_md5_hashes()
+
+
+def embedding_dims(dim=3072):
+    """
+    (dim, index_dim) from EMBEDDING_DIM and INDEX_DIM (environment or .env file): `dim` is the size of
+    the embeddings requested from Gemini and stored, `index_dim` the size of the vectors in the ANN index.
+    """
+    config = dotenv_values(".env")
+    dim = int(os.environ.get("EMBEDDING_DIM") or config.get("EMBEDDING_DIM") or dim)
+    index_dim = int(os.environ.get("INDEX_DIM") or config.get("INDEX_DIM") or dim)
+    return dim, index_dim
+
+
+def stored_count(backend, collection_name):
+    """Number of records of an existing collection of `backend`, 0 when there is none (nothing is created)."""
+    if backend == "local":
+        from local_vector_db import LocalVectorDb
+        vectors_path = os.path.join("local_vectors", collection_name, "vectors.npy")
+        if not os.path.isfile(vectors_path):
+            return 0
+        dim = np.load(vectors_path, mmap_mode="r").shape[1]
+        return LocalVectorDb(collection_name=collection_name, dim=dim).count()
+    from pymilvus import utility, Collection
+    if not utility.has_collection(collection_name):
+        return 0
+    return Collection(collection_name).num_entities
+
+
+def get_vector_db(collection_name="image_embeddings", dim=None):
+    """
+    Returns the vector store selected by VECTOR_BACKEND (environment or .env file):
+    "milvus" (default) for the Milvus server, "local" for the NumPy exact search backend.
+    `dim` defaults to EMBEDDING_DIM, the size of the Embedder's vectors (see embedding_dims).
+    With INDEX_DIM set below `dim` the index only holds truncated vectors and the full ones
+    re-rank its candidates (RerankingVectorDb).
+    """
+    config = dotenv_values(".env")
+    backend = (os.environ.get("VECTOR_BACKEND") or config.get("VECTOR_BACKEND") or "milvus").lower()
+    configured_dim, index_dim = embedding_dims()
+    dim = dim or configured_dim
+    if index_dim < dim:
+        # A separate collection, its schema has a different dimension
+        index_collection = f"{collection_name}_{index_dim}"
+    else:
+        index_collection, index_dim = collection_name, dim
+
+    if backend == "local":
+        from local_vector_db import LocalVectorDb
+        index_db = LocalVectorDb(collection_name=index_collection, dim=index_dim)
+    else:
+        index_db = MilvusDb(collection_name=index_collection, dim=index_dim)
+    if index_dim == dim:
+        return index_db
+
+    from local_vector_db import LocalVectorDb
+    full_db = LocalVectorDb(collection_name=f"{collection_name}_full", dim=dim)
+    if index_db.count() == 0:
+        existing = stored_count(backend, collection_name)
+        if existing:
+            print(f"Warning: with INDEX_DIM={index_dim} searches use the empty collection '{index_collection}', "
+                  f"not the {existing} vectors of '{collection_name}'. Searches return nothing until "
+                  f"main.py --embed-text (or POST /embed-text) has filled it, from the embedding cache.")
+    return RerankingVectorDb(index_db, full_db)